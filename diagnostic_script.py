@@ -1,9 +1,11 @@
 import os
-import pandas as pd
 import sqlite3
 import mysql.connector
 import logging
 
+# Lecture du CSV servie par le cache de staging de l'ETL (frame typée, projetée en mémoire)
+from distributech_etl_improved import extract_csv
+
 # Configuration (copiée de votre script)
 MYSQL_USER = 'appuser'
 MYSQL_PASSWORD = 'example_password'
@@ -41,10 +43,11 @@ def analyser_structure_sqlite():
             logging.info(f"  - {col[1]} ({col[2]})")
         
         # Échantillon de données
-        df = pd.read_sql(f"SELECT * FROM {table} LIMIT 3", conn)
+        cursor = conn.execute(f"SELECT * FROM {table} LIMIT 3")
+        names = [description[0] for description in cursor.description]
         logging.info("Échantillon de données:")
-        for index, row in df.iterrows():
-            logging.info(f"  {dict(row)}")
+        for row in cursor.fetchall():
+            logging.info(f"  {dict(zip(names, row))}")
     
     conn.close()
 
@@ -98,7 +101,7 @@ def analyser_csv():
         logging.warning(f"Fichier CSV non trouvé: {CSV_PATH}")
         return
     
-    df = pd.read_csv(CSV_PATH)
+    df = extract_csv(CSV_PATH, incremental=False)
     logging.info(f"Nombre de lignes: {len(df)}")
     logging.info(f"Colonnes: {list(df.columns)}")
     
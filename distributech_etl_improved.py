@@ -1,12 +1,24 @@
 import pandas as pd
-import sqlite3
 import logging
 from sqlalchemy import create_engine, types, text
 import os
 import mysql.connector
 from datetime import datetime
 import subprocess
+import re
+from contextlib import contextmanager, nullcontext, closing
+from concurrent.futures import ThreadPoolExecutor
+import time
 import numpy as np
+from run_manifest import source_fingerprints, sources_unchanged, save_manifest
+from etl_common import (
+    CSV_DTYPES, CSV_DATE_FORMATS, CSV_ENGINE, STAGING_ENABLED, feather, _pending_csv_checkpoints,
+    create_table_if_not_exists, csv_tail_range, open_csv_range,
+    csv_line_counts, update_line_counts, csv_staging_key, save_csv_checkpoints, sqlite_digest, staging_key, read_staged,
+    write_staged, evict_staging, sqlite_readonly, iter_keyset_pages, concat_pages, extract_incremental,
+    save_watermarks, connect, commit, insert_missing_keys, to_sql_batched, upsert_rows, use_bulk_index,
+    index_covers, natural_key, mouvement_key, assign_surrogate_keys, seed_key_registries,
+)
 
 # === CONFIGURATION ===
 MYSQL_USER = 'appuser'
@@ -16,38 +28,260 @@ MYSQL_PORT = '3307'
 MYSQL_DB = 'distributech_db'
 
 SQLITE_DB_PATH = './data/base_stock.sqlite'
+# Tables SQLite lues par le pipeline : {table: clé primaire} (sqlite_sequence et tables internes ignorées)
+SQLITE_TABLES = {'region': 'region_id', 'revendeur': 'revendeur_id', 'produit': 'product_id', 'production': 'production_id'}
+# Tables SQLite extraites de façon incrémentale : {table: colonne monotone}
+INCREMENTAL_TABLES = {'production': 'production_id'}
+# Threads d'extraction : une connexion SQLite en lecture seule par table, le CSV dans son propre thread
+EXTRACT_WORKERS = 4
 CSV_PATH = 'commande_revendeur_tech_express.csv'
+# Run sauté si aucune source (ni le code de l'ETL) n'a changé depuis le dernier run réussi
+SKIP_UNCHANGED_RUNS = True
+# Reprise de la lecture du CSV au dernier octet consommé (points de reprise : etl_common.CSV_CHECKPOINT_PATH)
+CSV_CHECKPOINT = True
 EXPORT_DIR = './exports'
+# Lignes rejetées par la validation, avec leurs motifs (Parquet si pyarrow est disponible, sinon CSV)
+QUARANTINE_DIR = './data/quarantine'
+# Tables chargées via LOAD DATA LOCAL INFILE plutôt que to_sql (ex. {'LignesCommande'})
+BULK_LOAD_TABLES = set()
+# Tables mises à jour par upsert (ON DUPLICATE KEY UPDATE) au lieu d'ignorer les clés existantes
+UPSERT_TABLES = set()
+# Session de chargement massif : une connexion, contrôles FK/unicité coupés, gros commits
+BULK_SESSION = False
 os.makedirs(EXPORT_DIR, exist_ok=True)
 
+# Colonnes numériques et dates du CSV lues en texte puis converties par coerce_csv_types() :
+# une valeur invalide devient nulle et sa ligne part en quarantaine à la validation
+CSV_TEXT_COLUMNS = [col for col, dtype in CSV_DTYPES.items()
+                    if col in CSV_DATE_FORMATS or pd.api.types.is_numeric_dtype(pd.api.types.pandas_dtype(dtype))]
+CSV_READ_DTYPES = {**CSV_DTYPES, **dict.fromkeys(CSV_TEXT_COLUMNS, 'str')}
+
+# Débit (lignes/s) observé avec index par table, pour estimer le gain du mode sans index
+_indexed_load_rates = {}
+
+# Clés primaires validées par table pendant ce run, référencées par les règles 'fk'
+_valid_keys = {}
+
 # === LOGGING ===
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
+# === DÉFINITION DES TABLES MYSQL ===
+# Dans l'ordre des clés étrangères (les FK sont relues dans les clauses REFERENCES)
+TABLE_DEFINITIONS = {
+    'Regions': """
+    CREATE TABLE IF NOT EXISTS Regions (
+        region_id INT PRIMARY KEY,
+        nom_region VARCHAR(255) NOT NULL
+    )""",
+    'Revendeurs': """
+    CREATE TABLE IF NOT EXISTS Revendeurs (
+        revendeur_id INT PRIMARY KEY,
+        nom_revendeur VARCHAR(255) NOT NULL,
+        region_id INT,
+        email_contact VARCHAR(255),
+        FOREIGN KEY (region_id) REFERENCES Regions(region_id)
+    )""",
+    'Produits': """
+    CREATE TABLE IF NOT EXISTS Produits (
+        produit_id INT PRIMARY KEY,
+        nom_produit VARCHAR(255) NOT NULL,
+        prix_unitaire DECIMAL(10,2)
+    )""",
+    'Productions': """
+    CREATE TABLE IF NOT EXISTS Productions (
+        production_id INT PRIMARY KEY,
+        product_id INT NOT NULL,
+        quantite_produite INT NOT NULL,
+        date DATE NOT NULL,
+        FOREIGN KEY (product_id) REFERENCES Produits(produit_id)
+    )""",
+    'Commandes': """
+    CREATE TABLE IF NOT EXISTS Commandes (
+        commande_id INT PRIMARY KEY,
+        numero_commande VARCHAR(255) NOT NULL,
+        date_commande DATETIME NOT NULL,
+        revendeur_id INT NOT NULL,
+        FOREIGN KEY (revendeur_id) REFERENCES Revendeurs(revendeur_id)
+    )""",
+    'LignesCommande': """
+    CREATE TABLE IF NOT EXISTS LignesCommande (
+        ligne_id INT PRIMARY KEY,
+        commande_id INT NOT NULL,
+        produit_id INT NOT NULL,
+        quantite INT NOT NULL,
+        prix_unitaire_vente DECIMAL(10,2),
+        FOREIGN KEY (commande_id) REFERENCES Commandes(commande_id),
+        FOREIGN KEY (produit_id) REFERENCES Produits(produit_id)
+    )""",
+    'MouvementsStock': """
+    CREATE TABLE IF NOT EXISTS MouvementsStock (
+        mouvement_id INT PRIMARY KEY,
+        produit_id INT NOT NULL,
+        type_mouvement ENUM('ENTREE', 'SORTIE') NOT NULL,
+        quantite INT NOT NULL,
+        date_mouvement DATETIME NOT NULL,
+        reference VARCHAR(255),
+        commande_id INT,
+        FOREIGN KEY (produit_id) REFERENCES Produits(produit_id),
+        FOREIGN KEY (commande_id) REFERENCES Commandes(commande_id)
+    )""",
+}
+
+# === RÈGLES DE VALIDATION ===
+# Par table : colonnes non nulles, types attendus ('int', 'float', 'date'),
+# bornes inclusives (None = ouverte), format (expression régulière) et clés
+# étrangères (colonne -> table parente, vérifiée contre les clés validées du run).
+VALIDATION_RULES = {
+    'Regions': {
+        'not_null': ['nom_region'],
+    },
+    'Revendeurs': {
+        'not_null': ['nom_revendeur'],
+        'fk': {'region_id': 'Regions'},
+    },
+    'Produits': {
+        'not_null': ['nom_produit'],
+        'types': {'prix_unitaire': 'float'},
+        'ranges': {'prix_unitaire': (0, None)},
+    },
+    'Productions': {
+        'not_null': ['product_id', 'quantite_produite', 'date'],
+        'types': {'product_id': 'int', 'quantite_produite': 'int', 'date': 'date'},
+        'ranges': {'quantite_produite': (0, None)},
+        'fk': {'product_id': 'Produits'},
+    },
+    'Commandes': {
+        'not_null': ['numero_commande', 'date_commande', 'revendeur_id'],
+        'types': {'date_commande': 'date', 'revendeur_id': 'int'},
+        'regex': {'numero_commande': r'CMD-\d{8}-\d{3}'},
+        'fk': {'revendeur_id': 'Revendeurs'},
+    },
+    'LignesCommande': {
+        'not_null': ['commande_id', 'produit_id', 'quantite'],
+        'types': {'quantite': 'int', 'prix_unitaire_vente': 'float'},
+        'ranges': {'quantite': (1, None), 'prix_unitaire_vente': (0, None)},
+        'fk': {'commande_id': 'Commandes', 'produit_id': 'Produits'},
+    },
+    'MouvementsStock': {
+        'not_null': ['produit_id', 'type_mouvement', 'quantite', 'date_mouvement'],
+        'types': {'quantite': 'int', 'date_mouvement': 'date'},
+        'fk': {'produit_id': 'Produits', 'commande_id': 'Commandes'},
+    },
+}
+
+
+# === FONCTION : Masques de rejet ===
+def rule_failures(df, rules, pk_column=None):
+    """Évalue les règles sur tout le DataFrame : {code motif: masque booléen (numpy) des lignes en échec}.
+
+    Une valeur nulle n'échoue que sur 'not_null' : type, borne, format et
+    clé étrangère ne portent que sur les valeurs renseignées.
+    """
+    failures = {}
+    if pk_column:
+        failures[f"{pk_column}:null"] = df[pk_column].isna()
+    for col in rules.get('not_null', []):
+        failures[f"{col}:null"] = df[col].isna()
+
+    numeric = {}
+    for col, kind in rules.get('types', {}).items():
+        if col not in df.columns:
+            continue
+        values = df[col]
+        if kind == 'date':
+            if not pd.api.types.is_datetime64_any_dtype(values):
+                failures[f"{col}:type"] = values.notna() & pd.to_datetime(values, errors='coerce').isna()
+            continue
+        numeric[col] = values if pd.api.types.is_numeric_dtype(values) else pd.to_numeric(values, errors='coerce')
+        invalid = numeric[col].isna()
+        if kind == 'int' and not pd.api.types.is_integer_dtype(values):
+            invalid |= numeric[col] % 1 != 0
+        failures[f"{col}:type"] = values.notna() & invalid
+
+    for col, (low, high) in rules.get('ranges', {}).items():
+        if col not in df.columns:
+            continue
+        values = numeric.get(col, df[col])
+        out_of_range = pd.Series(False, index=df.index)
+        if low is not None:
+            out_of_range |= values < low
+        if high is not None:
+            out_of_range |= values > high
+        failures[f"{col}:borne"] = out_of_range
+
+    for col, pattern in rules.get('regex', {}).items():
+        values = df[col]
+        if not isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype('string')
+        # Sur une colonne category, le motif n'est évalué qu'une fois par modalité
+        failures[f"{col}:format"] = ~values.str.fullmatch(pattern).fillna(True).astype(bool)
+
+    for col, parent in rules.get('fk', {}).items():
+        if col in df.columns and parent in _valid_keys:
+            failures[f"{col}:fk"] = df[col].notna() & ~df[col].isin(_valid_keys[parent])
+
+    # Colonnes nullables (Int32...) : une comparaison sur <NA> n'est pas un échec
+    failures = {code: mask.fillna(False).to_numpy(dtype=bool) for code, mask in failures.items()}
+    if pk_column:
+        # Doublons cherchés parmi les lignes valides : la première ligne valide de chaque clé est gardée
+        keys = df[pk_column].mask(np.logical_or.reduce(list(failures.values())))
+        failures[f"{pk_column}:doublon"] = (keys.duplicated() & keys.notna()).to_numpy()
+    return failures
+
+
+# === FONCTION : Quarantaine des lignes rejetées ===
+def quarantine_rows(rejected, table_name, directory=QUARANTINE_DIR):
+    """Écrit les lignes rejetées et leur colonne 'motifs_rejet' dans un fichier horodaté"""
+    os.makedirs(directory, exist_ok=True)
+    stem = f"{directory}/{table_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    if feather is not None:
+        # Colonnes objet en texte : une valeur mal typée ne doit pas faire échouer l'écriture
+        rejected = rejected.astype({col: str for col in rejected.select_dtypes(include=['object']).columns})
+        path = f"{stem}.parquet"
+        rejected.to_parquet(path, index=False)
+    else:
+        path = f"{stem}.csv"
+        rejected.to_csv(path, index=False)
+    return path
+
+
 # === FONCTION : Validation des données ===
-def validate_dataframe(df, table_name, required_columns, pk_column=None):
-    """Valide la structure et la cohérence des données d'un DataFrame"""
+def validate_dataframe(df, table_name, required_columns, pk_column=None, rules=None):
+    """Valide un DataFrame contre les règles de sa table et met les lignes rejetées en quarantaine.
+
+    Toutes les règles sont évaluées en une passe vectorisée ; une ligne qui en
+    viole au moins une part en quarantaine avec ses codes motif (ex.
+    'quantite:borne;produit_id:fk'), les autres continuent. Seule une colonne
+    requise absente reste bloquante.
+    """
     logging.info(f"🔍 Validation des données pour '{table_name}'")
+    rules = VALIDATION_RULES.get(table_name, {}) if rules is None else rules
     
     # Vérifier les colonnes requises
     missing_cols = [col for col in required_columns if col not in df.columns]
     if missing_cols:
         raise ValueError(f"❌ Colonnes manquantes dans '{table_name}': {missing_cols}")
     
-    # Vérifier les valeurs nulles dans la clé primaire
-    if pk_column and df[pk_column].isnull().any():
-        raise ValueError(f"❌ Valeurs nulles détectées dans la clé primaire '{pk_column}' de '{table_name}'")
-    
-    # Vérifier les doublons dans la clé primaire
-    if pk_column and df[pk_column].duplicated().any():
-        duplicates_count = df[pk_column].duplicated().sum()
-        logging.warning(f"⚠️  {duplicates_count} doublons détectés dans '{pk_column}' de '{table_name}'")
-        df = df.drop_duplicates(subset=[pk_column], keep='first')
+    failures = rule_failures(df, rules, pk_column)
+    reject = np.logical_or.reduce(list(failures.values())) if failures else np.zeros(len(df), dtype=bool)
+    if reject.any():
+        rejected = df[reject].copy()
+        reasons = pd.Series('', index=rejected.index)
+        for code, mask in failures.items():
+            reasons += np.where(mask[reject], code + ';', '')
+        rejected['motifs_rejet'] = reasons.str.rstrip(';')
+        path = quarantine_rows(rejected, table_name)
+        counts = {code: int(mask.sum()) for code, mask in failures.items() if mask.any()}
+        logging.warning(f"⚠️  {len(rejected)} lignes rejetées de '{table_name}' {counts} -> {path}")
+        df = df[~reject].copy()
     
     # Nettoyer les valeurs nulles dans les colonnes texte
     for col in df.select_dtypes(include=['object']).columns:
         df[col] = df[col].fillna('').astype(str).str.strip()
     
+    if pk_column:
+        _valid_keys[table_name] = pd.Index(df[pk_column])
     logging.info(f"✅ Validation terminée pour '{table_name}' - {len(df)} lignes valides")
     return df
 
@@ -81,7 +315,8 @@ def creer_utilisateur_mysql():
 
             # Attribuer les droits nécessaires
             privileges = (
-                "SELECT, INSERT, UPDATE, DELETE, LOCK TABLES, "
+                "SELECT, INSERT, UPDATE, DELETE, ALTER, INDEX, REFERENCES, "
+                "CREATE TEMPORARY TABLES, LOCK TABLES, "
                 "SHOW VIEW, EVENT, TRIGGER"
             )
             cursor.execute(f"GRANT {privileges} ON {MYSQL_DB}.* TO 'appuser'@'localhost';")
@@ -93,27 +328,52 @@ def creer_utilisateur_mysql():
         raise
 
 
-# === FONCTION : Créer les tables si elles n'existent pas ===
-def create_table_if_not_exists(engine, create_table_sql):
-    with engine.connect() as connection:
-        try:
-            connection.execute(text(create_table_sql))
-            connection.commit()
-            logging.info("✅ Table créée ou existe déjà")
-        except Exception as e:
-            logging.error(f"❌ Erreur lors de la création de la table : {e}")
-            raise
+# === FONCTION : Typer le CSV sans échec de lecture ===
+def coerce_csv_types(df):
+    """Convertit les colonnes CSV_TEXT_COLUMNS (lues en texte) vers CSV_DTYPES et CSV_DATE_FORMATS.
+
+    Une valeur non convertible devient nulle au lieu de faire échouer la
+    lecture de tout le fichier : les règles not_null de VALIDATION_RULES
+    mettent ensuite sa ligne en quarantaine.
+    """
+    for col in CSV_TEXT_COLUMNS:
+        if col not in df.columns:
+            continue
+        raw = df[col]
+        if col in CSV_DATE_FORMATS:
+            typed = pd.to_datetime(raw, format=CSV_DATE_FORMATS[col], errors='coerce')
+        else:
+            typed = pd.to_numeric(raw, errors='coerce')
+            if pd.api.types.is_integer_dtype(pd.api.types.pandas_dtype(CSV_DTYPES[col])):
+                typed = typed.where(typed % 1 == 0)
+            typed = typed.astype(CSV_DTYPES[col])
+        invalid = int((raw.notna() & typed.isna()).sum())
+        if invalid:
+            logging.warning(f"⚠️  {invalid} valeurs invalides dans la colonne '{col}' du CSV, remplacées par nul")
+        df[col] = typed
+    return df
 
 
 # === FONCTION : Extraire CSV ===
-def extract_csv(path):
-    """Extrait et valide les données du fichier CSV des commandes"""
-    logging.info("📥 Extraction du fichier CSV...")
+def extract_csv(path, incremental=CSV_CHECKPOINT):
+    """Extrait les données du fichier CSV des commandes (schéma CSV_DTYPES, valeurs invalides mises à nul)"""
+    logging.info(f"📥 Extraction du fichier CSV (moteur {CSV_ENGINE})...")
     if not os.path.exists(path):
         raise FileNotFoundError(f"❌ Fichier CSV introuvable : {path}")
     
     try:
-        df = pd.read_csv(path)
+        # Seules les lignes ajoutées depuis le dernier point de reprise sont lues
+        header, start, end = csv_tail_range(path, incremental)
+        checkpoint = _pending_csv_checkpoints[os.path.abspath(path)]
+        key = csv_staging_key(path, header, start, end, CSV_READ_DTYPES)
+        df, staged_checkpoint = read_staged(key)
+        if df is not None:
+            # Position atteinte dans une source compressée : enregistrée avec la frame
+            checkpoint.update(staged_checkpoint or {})
+        else:
+            with open_csv_range(path, header, start, end) as stream:
+                df = coerce_csv_types(pd.read_csv(stream, engine=CSV_ENGINE, dtype=CSV_READ_DTYPES))
+            write_staged(key, df, {k: v for k, v in checkpoint.items() if k != 'line_counts'})
         logging.info(f"✅ {len(df)} lignes extraites du CSV")
         
         # Validation des colonnes essentielles du CSV
@@ -128,49 +388,182 @@ def extract_csv(path):
         raise
 
 
+# === FONCTION : Extraire une table SQLite ===
+def extract_table(db_path, table, incremental=True, db_digest=None):
+    """Lit une table sur sa propre connexion (extraction concurrente des tables).
+
+    Avec `db_digest` (empreinte de la base), la table complète est servie
+    par le cache de staging si la base n'a pas changé. La pagination par clé
+    borne chaque requête, pas la frame : une lecture complète (premier run,
+    mark invalidé, chargement fantôme) assemble toute la table en mémoire.
+    """
+    if incremental and table in INCREMENTAL_TABLES:
+        with closing(sqlite_readonly(db_path)) as conn:
+            return extract_incremental(conn, table, INCREMENTAL_TABLES[table])
+    key = staging_key('sqlite', db_digest, table) if db_digest else None
+    df, _ = read_staged(key)
+    if df is None:
+        with closing(sqlite_readonly(db_path)) as conn:
+            df = concat_pages(conn, table, iter_keyset_pages(conn, table, SQLITE_TABLES[table]))
+        write_staged(key, df)
+    logging.info(f"✅ Table '{table}' : {len(df)} lignes")
+    return df
+
+
 # === FONCTION : Extraire SQLite ===
-def extract_sqlite(db_path):
-    """Extrait toutes les données de la base SQLite"""
+def extract_sqlite(db_path, incremental=True):
+    """Extrait les tables SQLITE_TABLES de la base SQLite (nouvelles lignes seulement pour INCREMENTAL_TABLES)"""
     logging.info(f"🗄️  Connexion à la base SQLite : {db_path}")
     if not os.path.exists(db_path):
         raise FileNotFoundError(f"❌ Base SQLite introuvable : {db_path}")
 
-    with sqlite3.connect(db_path) as conn:
-        tables = pd.read_sql("SELECT name FROM sqlite_master WHERE type='table';", conn)
-        data = {}
-        for table in tables['name']:
-            df = pd.read_sql(f"SELECT * FROM {table}", conn)
-            data[table] = df
-            logging.info(f"✅ Table '{table}' : {len(df)} lignes")
-    return data
+    with closing(sqlite_readonly(db_path)) as conn:
+        existing = pd.read_sql("SELECT name FROM sqlite_master WHERE type='table';", conn)['name']
+    tables = [table for table in SQLITE_TABLES if table in set(existing)]
+    # Lectures indépendantes : chaque table sur sa connexion, en parallèle
+    db_digest = sqlite_digest(db_path) if STAGING_ENABLED else None
+    with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as pool:
+        futures = {table: pool.submit(extract_table, db_path, table, incremental, db_digest)
+                   for table in tables}
+    return {table: future.result() for table, future in futures.items()}
+
+
+# === FONCTION : Clés étrangères déclarées ===
+def foreign_keys(table_definitions=TABLE_DEFINITIONS):
+    """Retourne [(table, colonne, table référencée, colonne référencée)] d'après les DDL"""
+    pattern = r"FOREIGN KEY\s*\(`?(\w+)`?\)\s*REFERENCES\s+`?(\w+)`?\s*\(`?(\w+)`?\)"
+    return [
+        (table, column, parent, parent_column)
+        for table, ddl in table_definitions.items()
+        for column, parent, parent_column in re.findall(pattern, ddl, re.IGNORECASE)
+    ]
+
+
+# === FONCTION : Contrôle d'intégrité après chargement ===
+def check_foreign_keys(conn, tables):
+    """Compte les lignes orphelines de `tables` (une requête par FK) et lève une erreur s'il y en a"""
+    orphans = {}
+    for table, column, parent, parent_column in foreign_keys():
+        if table not in tables:
+            continue
+        count = conn.execute(text(
+            f"SELECT COUNT(*) FROM `{table}` c "
+            f"LEFT JOIN `{parent}` p ON p.`{parent_column}` = c.`{column}` "
+            f"WHERE c.`{column}` IS NOT NULL AND p.`{parent_column}` IS NULL"
+        )).scalar()
+        if count:
+            orphans[f"{table}.{column} -> {parent}"] = count
+    if orphans:
+        raise ValueError(f"❌ Lignes orphelines après chargement : {orphans}")
+    logging.info(f"✅ Intégrité référentielle vérifiée pour {len(tables)} tables")
+
+
+# === FONCTION : Session de chargement massif ===
+@contextmanager
+def bulk_load_session(engine, tables):
+    """Épingle une connexion pour tout le chargement et y coupe les contrôles ligne à ligne.
+
+    foreign_key_checks, unique_checks et autocommit sont désactivés sur la
+    connexion qui écrit réellement (et non sur une autre connexion du pool),
+    les écritures sont validées par transactions de BULK_COMMIT_ROWS lignes,
+    les réglages d'origine sont restaurés en sortie et l'intégrité des
+    `tables` est contrôlée en une passe après le chargement.
+    """
+    with engine.connect() as conn:
+        saved = conn.execute(text(
+            "SELECT @@SESSION.foreign_key_checks, @@SESSION.unique_checks, @@SESSION.autocommit"
+        )).one()
+        conn.execute(text("SET SESSION foreign_key_checks = 0, unique_checks = 0, autocommit = 0"))
+        conn.info['bulk_session'] = {'pending': 0}
+        logging.info("⚡ Session de chargement massif ouverte (contrôles FK/unicité suspendus)")
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.info.pop('bulk_session', None)
+            try:
+                conn.execute(
+                    text("SET SESSION foreign_key_checks = :fk, unique_checks = :uc, autocommit = :ac"),
+                    {'fk': saved[0], 'uc': saved[1], 'ac': saved[2]}
+                )
+                conn.commit()
+            except Exception as e:
+                # Ne jamais rendre au pool une connexion sans contrôle des FK
+                logging.error(f"❌ Restauration des réglages de session impossible : {e}")
+                conn.invalidate()
+                raise
+        check_foreign_keys(conn, tables)
+
+
+# === FONCTION : Index secondaires retirés pendant un gros chargement ===
+@contextmanager
+def secondary_indexes_dropped(conn, table_name):
+    """Retire les index secondaires non uniques (et les seules FK qui s'appuient dessus) le temps du bloc.
+
+    Les définitions sont relues dans SHOW CREATE TABLE puis reconstruites en un
+    seul ALTER TABLE ... ADD INDEX / ADD CONSTRAINT, y compris si le bloc
+    échoue ; les clés étrangères sont ensuite contrôlées en une passe
+    (check_foreign_keys) plutôt que ligne à ligne pendant l'ALTER.
+    foreign_key_checks retrouve sa valeur d'entrée. Les ALTER TABLE valident
+    implicitement la transaction en cours : ne pas l'utiliser dans une session
+    de chargement massif (use_bulk_index l'écarte).
+    Donne un dictionnaire où est reporté le temps de reconstruction.
+    """
+    ddl = conn.execute(text(f"SHOW CREATE TABLE `{table_name}`")).one()[1]
+    keys = re.findall(r"^\s*(KEY `([^`]+)` \((.*)\).*?),?$", ddl, re.MULTILINE)
+    timings = {'rebuild': 0.0}
+    if not keys:
+        yield timings
+        return
+    # Une FK a besoin d'un index commençant par ses colonnes : seules celles que portent
+    # uniquement les index retirés (ni la clé primaire ni un index unique) sont retirées
+    kept = re.findall(r"^\s*(?:PRIMARY|UNIQUE) KEY .*?\((.*)\)", ddl, re.MULTILINE)
+    fks = [
+        (definition, name)
+        for definition, name, columns in re.findall(
+            r"^\s*(CONSTRAINT `([^`]+)` FOREIGN KEY \(([^)]*)\).*?),?$", ddl, re.MULTILINE)
+        if any(index_covers(key_columns, columns) for _, _, key_columns in keys)
+        and not any(index_covers(index, columns) for index in kept)
+    ]
+    saved_checks = conn.execute(text("SELECT @@SESSION.foreign_key_checks")).scalar()
+
+    if fks:
+        conn.execute(text(f"ALTER TABLE `{table_name}` " + ", ".join(f"DROP FOREIGN KEY `{name}`" for _, name in fks)))
+    conn.execute(text(f"ALTER TABLE `{table_name}` " + ", ".join(f"DROP INDEX `{name}`" for _, name, _ in keys)))
+    logging.info(f"🗂️  '{table_name}' : {len(keys)} index secondaires et {len(fks)} FK retirés pour le chargement")
+    try:
+        yield timings
+    finally:
+        started = time.perf_counter()
+        # FK contrôlées en une passe après l'ALTER : pas de revalidation ligne à ligne
+        conn.execute(text("SET SESSION foreign_key_checks = 0"))
+        try:
+            conn.execute(text(f"ALTER TABLE `{table_name}` " + ", ".join(
+                [f"ADD {definition}" for definition, _, _ in keys] + [f"ADD {definition}" for definition, _ in fks]
+            )))
+        finally:
+            conn.execute(text("SET SESSION foreign_key_checks = :checks"), {'checks': saved_checks})
+        timings['rebuild'] = time.perf_counter() - started
+        logging.info(f"🗂️  '{table_name}' : index reconstruits en {timings['rebuild']:.1f}s")
+    # Atteint seulement si le bloc a réussi ; une erreur du bloc est relancée après la reconstruction
+    check_foreign_keys(conn, {table_name})
 
 
 # === FONCTION : Charger avec anti-doublons ===
-def load_to_mysql_deduplicated(df, table_name, engine, pk_column, index_as_pk=False):
-    """Charge les données dans MySQL en évitant les doublons"""
-    logging.info(f"🔁 Chargement dans MySQL (anti-doublons) : '{table_name}'")
+def load_to_mysql_deduplicated(df, table_name, engine, pk_column, index_as_pk=False, bulk=None, upsert=None):
+    """Charge les données dans MySQL en évitant les doublons (filtrage côté serveur)"""
+    if bulk is None:
+        bulk = table_name in BULK_LOAD_TABLES
+    if upsert is None:
+        upsert = table_name in UPSERT_TABLES
+    logging.info(f"🔁 Chargement dans MySQL (anti-doublons{', LOAD DATA' if bulk else ''}) : '{table_name}'")
     
     if df.empty:
         logging.info(f"🟡 Aucune donnée à charger dans '{table_name}'")
         return
-    
-    with engine.connect() as conn:
-        # Vérifier si la table existe et récupérer les IDs existants
-        try:
-            conn.execute(text(f"SELECT 1 FROM `{table_name}` LIMIT 1"))
-            has_table = True
-        except Exception:
-            has_table = False
-
-        if has_table and pk_column:
-            try:
-                existing = pd.read_sql(f"SELECT `{pk_column}` FROM `{table_name}`", conn)
-                existing_ids = existing[pk_column].dropna().tolist()
-                original_count = len(df)
-                df = df[~df[pk_column].isin(existing_ids)]
-                logging.info(f"➡️  {len(df)} nouvelles lignes après filtrage des doublons ({original_count - len(df)} doublons évités)")
-            except Exception as e:
-                logging.warning(f"⚠️  Impossible de lire les IDs existants dans '{table_name}' : {e}")
 
     # Définir les types SQL appropriés
     dtype_mapping = {}
@@ -186,60 +579,104 @@ def load_to_mysql_deduplicated(df, table_name, engine, pk_column, index_as_pk=Fa
         elif 'datetime' in str(df[col].dtype):
             dtype_mapping[col] = types.DateTime()
 
-    if not df.empty:
+    with connect(engine) as conn:
+        # Vérifier si la table existe
         try:
-            df.to_sql(
-                table_name,
-                con=engine,
-                if_exists='append',
-                index=index_as_pk,
-                dtype=dtype_mapping
-            )
-            logging.info(f"✅ {len(df)} lignes insérées dans '{table_name}'")
-        except Exception as e:
-            logging.error(f"❌ Échec du chargement dans '{table_name}' : {e}")
-            raise
-    else:
-        logging.info(f"🟡 Aucune nouvelle ligne à insérer dans '{table_name}'")
+            conn.execute(text(f"SELECT 1 FROM `{table_name}` LIMIT 1"))
+            has_table = True
+        except Exception:
+            has_table = False
+
+        if has_table and pk_column and upsert:
+            # Les clés existantes sont mises à jour avec les valeurs corrigées
+            try:
+                affected = upsert_rows(conn, df, table_name, pk_column, index_as_pk=index_as_pk)
+                commit(conn, len(df))
+            except Exception as e:
+                logging.error(f"❌ Échec de l'upsert dans '{table_name}' : {e}")
+                raise
+            logging.info(f"✅ Upsert de {len(df)} lignes dans '{table_name}' ({affected} lignes affectées)")
+            return
+
+        if has_table and pk_column:
+            bulk_index = use_bulk_index(conn, table_name, len(df))
+            index_context = secondary_indexes_dropped(conn, table_name) if bulk_index else nullcontext({})
+            started = time.perf_counter()
+            # Les clés existantes ne quittent pas MySQL : table temporaire + anti-jointure
+            try:
+                with index_context as timings:
+                    inserted = insert_missing_keys(conn, df, table_name, pk_column, dtype_mapping, index_as_pk, bulk)
+                    commit(conn, inserted)
+            except Exception as e:
+                logging.error(f"❌ Échec du chargement dans '{table_name}' : {e}")
+                raise
+            logging.info(f"➡️  {inserted} nouvelles lignes après filtrage des doublons ({len(df) - inserted} doublons évités)")
+            elapsed = time.perf_counter() - started
+            if not bulk_index:
+                _indexed_load_rates[table_name] = len(df) / max(elapsed, 1e-6)
+            elif table_name in _indexed_load_rates:
+                estimated = len(df) / _indexed_load_rates[table_name]
+                logging.info(f"⏱️  '{table_name}' : {elapsed:.1f}s sans index (dont {timings['rebuild']:.1f}s de reconstruction), "
+                             f"~{estimated - elapsed:.1f}s gagnées par rapport au débit avec index")
+            else:
+                logging.info(f"⏱️  '{table_name}' : {elapsed:.1f}s sans index (dont {timings['rebuild']:.1f}s de reconstruction)")
+            if inserted:
+                logging.info(f"✅ {inserted} lignes insérées dans '{table_name}'")
+            else:
+                logging.info(f"🟡 Aucune nouvelle ligne à insérer dans '{table_name}'")
+            return
+
+    try:
+        with connect(engine) as conn:
+            to_sql_batched(df, table_name, conn, index_as_pk, dtype_mapping)
+        logging.info(f"✅ {len(df)} lignes insérées dans '{table_name}'")
+    except Exception as e:
+        logging.error(f"❌ Échec du chargement dans '{table_name}' : {e}")
+        raise
 
 
 # === FONCTION : Créer les mouvements de stock ===
 def create_mouvements_stock(engine, commandes_df, productions_df=None):
-    """Crée les mouvements de stock basés sur les commandes et productions"""
+    """Crée les mouvements de stock basés sur les commandes et productions.
+
+    Sorties et entrées sont construites colonne par colonne puis concaténées
+    en une fois.
+    """
     logging.info("📦 Création des mouvements de stock...")
     
     mouvements = []
     
     # Mouvements de sortie (commandes)
     if not commandes_df.empty:
-        for _, row in commandes_df.iterrows():
-            mouvement = {
-                'produit_id': row['produit_id'],
-                'type_mouvement': 'SORTIE',
-                'quantite': -abs(row['quantite']),  # Négatif pour les sorties
-                'date_mouvement': row['date_commande'],
-                'reference': f"CMD-{row['numero_commande']}",
-                'commande_id': row['commande_id']
-            }
-            mouvements.append(mouvement)
+        mouvements.append(pd.DataFrame({
+            'produit_id': commandes_df['produit_id'],
+            'type_mouvement': 'SORTIE',
+            'quantite': -commandes_df['quantite'].abs(),  # Négatif pour les sorties
+            'date_mouvement': commandes_df['date_commande'],
+            'reference': 'CMD-' + commandes_df['numero_commande'].astype(str),
+            'commande_id': commandes_df['commande_id'],
+            'source_id': commandes_df['ligne_id']
+        }))
     
     # Mouvements d'entrée (productions/réapprovisionnements)
     if productions_df is not None and not productions_df.empty:
-        for _, row in productions_df.iterrows():
-            mouvement = {
-                'produit_id': row['product_id'],
-                'type_mouvement': 'ENTREE',
-                'quantite': abs(row['quantite_produite']),  # Positif pour les entrées
-                'date_mouvement': row['date'],
-                'reference': f"PROD-{row['production_id']}",
-                'commande_id': None
-            }
-            mouvements.append(mouvement)
+        mouvements.append(pd.DataFrame({
+            'produit_id': productions_df['product_id'],
+            'type_mouvement': 'ENTREE',
+            'quantite': productions_df['quantite_produite'].abs(),  # Positif pour les entrées
+            'date_mouvement': productions_df['date'],
+            'reference': 'PROD-' + productions_df['production_id'].astype(str),
+            'commande_id': np.nan,
+            'source_id': productions_df['production_id']
+        }))
     
     if mouvements:
-        df_mouvements = pd.DataFrame(mouvements)
-        df_mouvements['mouvement_id'] = range(1, len(df_mouvements) + 1)
-        df_mouvements['date_mouvement'] = pd.to_datetime(df_mouvements['date_mouvement'])
+        df_mouvements = pd.concat(mouvements, ignore_index=True)
+        # ID permanent : une sortie par ligne de commande, une entrée par production (clé entière, voir mouvement_key)
+        df_mouvements['mouvement_id'] = assign_surrogate_keys(
+            'mouvement', mouvement_key(df_mouvements['type_mouvement'], df_mouvements['source_id']))
+        df_mouvements = df_mouvements.drop(columns=['source_id'])
+        # date_mouvement est déjà datetime64 : date_commande typée à l'extraction, date de production convertie dans main
         
         # Valider les données
         df_mouvements = validate_dataframe(
@@ -365,163 +802,139 @@ def export_etat_stocks(engine):
 def main():
     logging.info("🚀 Démarrage du script ETL Distributech")
 
+    # --- 0. Sources inchangées depuis le dernier run réussi : rien à faire ---
+    # Le code compte comme une source : ce script et les fonctions partagées d'etl_common
+    sources = [CSV_PATH, SQLITE_DB_PATH, __file__, os.path.join(os.path.dirname(__file__), 'etl_common.py')]
+    if SKIP_UNCHANGED_RUNS and sources_unchanged(sources):
+        logging.info("⏭️  Aucune source modifiée depuis le dernier run réussi : MySQL et exports inchangés")
+        return
+    # Empreintes prises avant l'extraction : une source modifiée pendant le run sera rechargée au suivant
+    fingerprints = source_fingerprints(sources)
+
     try:
         # --- 1. Créer l'utilisateur MySQL ---
         creer_utilisateur_mysql()
 
         # --- 2. Créer l'engine SQLAlchemy ---
         mysql_url = f"mysql+mysqlconnector://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
-        engine = create_engine(mysql_url, echo=False)
-
-        # --- 3. Extraire les données ---
-        df_csv = extract_csv(CSV_PATH)
-        sqlite_data = extract_sqlite(SQLITE_DB_PATH)
+        # LOAD DATA LOCAL INFILE doit être autorisé explicitement côté client
+        connect_args = {'allow_local_infile': True} if BULK_LOAD_TABLES else {}
+        engine = create_engine(mysql_url, echo=False, connect_args=connect_args)
+        # Registre de clés neuf : partir des ids déjà chargés dans MySQL avant toute attribution
+        seed_key_registries(engine, ['production', 'commande', 'ligne', 'mouvement'])
+
+        # --- 3. Extraire les données (CSV dans son thread, pendant la lecture des tables SQLite) ---
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            csv_future = pool.submit(extract_csv, CSV_PATH)
+            sqlite_data = extract_sqlite(SQLITE_DB_PATH)
+            df_csv = csv_future.result()
+        # Limite de taille du cache appliquée une fois toutes les extractions terminées
+        evict_staging()
 
         # --- 4. Créer les tables ---
         logging.info("🏗️  Création des tables...")
+        for create_table_sql in TABLE_DEFINITIONS.values():
+            create_table_if_not_exists(engine, create_table_sql)
+
+        # Avec BULK_SESSION, toutes les écritures passent par une seule connexion épinglée
+        load_context = bulk_load_session(engine, set(TABLE_DEFINITIONS)) if BULK_SESSION else nullcontext(engine)
+        with load_context as db:
+            # --- 5. Charger les données SQLite ---
+            logging.info("📤 Chargement des données SQLite...")
         
-        create_table_if_not_exists(engine, """
-        CREATE TABLE IF NOT EXISTS Regions (
-            region_id INT PRIMARY KEY,
-            nom_region VARCHAR(255) NOT NULL
-        )""")
-
-        create_table_if_not_exists(engine, """
-        CREATE TABLE IF NOT EXISTS Revendeurs (
-            revendeur_id INT PRIMARY KEY,
-            nom_revendeur VARCHAR(255) NOT NULL,
-            region_id INT,
-            email_contact VARCHAR(255),
-            FOREIGN KEY (region_id) REFERENCES Regions(region_id)
-        )""")
-
-        create_table_if_not_exists(engine, """
-        CREATE TABLE IF NOT EXISTS Produits (
-            produit_id INT PRIMARY KEY,
-            nom_produit VARCHAR(255) NOT NULL,
-            prix_unitaire DECIMAL(10,2)
-        )""")
-
-        create_table_if_not_exists(engine, """
-        CREATE TABLE IF NOT EXISTS Productions (
-            production_id INT PRIMARY KEY,
-            product_id INT NOT NULL,
-            quantite_produite INT NOT NULL,
-            date DATE NOT NULL,
-            FOREIGN KEY (product_id) REFERENCES Produits(produit_id)
-        )""")
-
-        create_table_if_not_exists(engine, """
-        CREATE TABLE IF NOT EXISTS Commandes (
-            commande_id INT PRIMARY KEY,
-            numero_commande VARCHAR(255) NOT NULL,
-            date_commande DATETIME NOT NULL,
-            revendeur_id INT NOT NULL,
-            FOREIGN KEY (revendeur_id) REFERENCES Revendeurs(revendeur_id)
-        )""")
-
-        create_table_if_not_exists(engine, """
-        CREATE TABLE IF NOT EXISTS LignesCommande (
-            ligne_id INT PRIMARY KEY,
-            commande_id INT NOT NULL,
-            produit_id INT NOT NULL,
-            quantite INT NOT NULL,
-            prix_unitaire_vente DECIMAL(10,2),
-            FOREIGN KEY (commande_id) REFERENCES Commandes(commande_id),
-            FOREIGN KEY (produit_id) REFERENCES Produits(produit_id)
-        )""")
-
-        create_table_if_not_exists(engine, """
-        CREATE TABLE IF NOT EXISTS MouvementsStock (
-            mouvement_id INT PRIMARY KEY,
-            produit_id INT NOT NULL,
-            type_mouvement ENUM('ENTREE', 'SORTIE') NOT NULL,
-            quantite INT NOT NULL,
-            date_mouvement DATETIME NOT NULL,
-            reference VARCHAR(255),
-            commande_id INT,
-            FOREIGN KEY (produit_id) REFERENCES Produits(produit_id),
-            FOREIGN KEY (commande_id) REFERENCES Commandes(commande_id)
-        )""")
-
-        # --- 5. Charger les données SQLite ---
-        logging.info("📤 Chargement des données SQLite...")
+            if 'region' in sqlite_data:
+                df = sqlite_data['region'].rename(columns={'region_name': 'nom_region'})
+                df = validate_dataframe(df, 'Regions', ['region_id', 'nom_region'], 'region_id')
+                load_to_mysql_deduplicated(df, 'Regions', db, pk_column='region_id')
+
+            if 'revendeur' in sqlite_data:
+                df = sqlite_data['revendeur'].rename(columns={'revendeur_name': 'nom_revendeur'})
+                # Générer des emails plus réalistes
+                df['email_contact'] = df.apply(lambda x: 
+                    f"{x['nom_revendeur'].lower().replace(' ', '.').replace('é', 'e').replace('è', 'e')}@{x['nom_revendeur'].lower().replace(' ', '')}.com", 
+                    axis=1)
+                df = validate_dataframe(df, 'Revendeurs', ['revendeur_id', 'nom_revendeur'], 'revendeur_id')
+                load_to_mysql_deduplicated(df, 'Revendeurs', db, pk_column='revendeur_id')
+
+            if 'produit' in sqlite_data:
+                df = sqlite_data['produit'].rename(columns={
+                    'product_name': 'nom_produit',
+                    'cout_unitaire': 'prix_unitaire',
+                    'product_id': 'produit_id'
+                })
+                df = validate_dataframe(df, 'Produits', ['produit_id', 'nom_produit'], 'produit_id')
+                load_to_mysql_deduplicated(df, 'Produits', db, pk_column='produit_id')
+
+            productions_df = None
+            if 'production' in sqlite_data:
+                productions_df = sqlite_data['production'].rename(columns={
+                    'quantity': 'quantite_produite',
+                    'date_production': 'date'
+                })
+                # ID permanent par production source (production_id AUTOINCREMENT de SQLite)
+                productions_df['production_id'] = assign_surrogate_keys(
+                    'production', natural_key(productions_df, ['production_id']))
+                productions_df['date'] = pd.to_datetime(productions_df['date'])
+                productions_df = validate_dataframe(productions_df, 'Productions', 
+                                                  ['production_id', 'product_id', 'quantite_produite', 'date'], 
+                                                  'production_id')
+                load_to_mysql_deduplicated(productions_df, 'Productions', db, pk_column='production_id')
+
+            # --- 6. Traiter les commandes CSV ---
+            logging.info("📦 Traitement des commandes CSV...")
         
-        if 'region' in sqlite_data:
-            df = sqlite_data['region'].rename(columns={'region_name': 'nom_region'})
-            df = validate_dataframe(df, 'Regions', ['region_id', 'nom_region'], 'region_id')
-            load_to_mysql_deduplicated(df, 'Regions', engine, pk_column='region_id')
-
-        if 'revendeur' in sqlite_data:
-            df = sqlite_data['revendeur'].rename(columns={'revendeur_name': 'nom_revendeur'})
-            # Générer des emails plus réalistes
-            df['email_contact'] = df.apply(lambda x: 
-                f"{x['nom_revendeur'].lower().replace(' ', '.').replace('é', 'e').replace('è', 'e')}@{x['nom_revendeur'].lower().replace(' ', '')}.com", 
-                axis=1)
-            df = validate_dataframe(df, 'Revendeurs', ['revendeur_id', 'nom_revendeur'], 'revendeur_id')
-            load_to_mysql_deduplicated(df, 'Revendeurs', engine, pk_column='revendeur_id')
-
-        if 'produit' in sqlite_data:
-            df = sqlite_data['produit'].rename(columns={
-                'product_name': 'nom_produit',
-                'cout_unitaire': 'prix_unitaire',
-                'product_id': 'produit_id'
+            df_csv = df_csv.rename(columns={
+                'commande_date': 'date_commande',
+                'quantity': 'quantite',
+                'unit_price': 'prix_unitaire_vente'
             })
-            df = validate_dataframe(df, 'Produits', ['produit_id', 'nom_produit'], 'produit_id')
-            load_to_mysql_deduplicated(df, 'Produits', engine, pk_column='produit_id')
-
-        productions_df = None
-        if 'production' in sqlite_data:
-            productions_df = sqlite_data['production'].rename(columns={
-                'quantity': 'quantite_produite',
-                'date_production': 'date'
-            }).reset_index()
-            productions_df['production_id'] = productions_df.index + 1
-            productions_df['date'] = pd.to_datetime(productions_df['date'])
-            productions_df = validate_dataframe(productions_df, 'Productions', 
-                                              ['production_id', 'product_id', 'quantite_produite', 'date'], 
-                                              'production_id')
-            load_to_mysql_deduplicated(productions_df, 'Productions', engine, pk_column='production_id')
-
-        # --- 6. Traiter les commandes CSV ---
-        logging.info("📦 Traitement des commandes CSV...")
-        
-        df_csv = df_csv.rename(columns={
-            'commande_date': 'date_commande',
-            'quantity': 'quantite',
-            'unit_price': 'prix_unitaire_vente'
-        })
-
-        # Générer un ID unique par commande basé sur numero_commande et date
-        df_csv['date_commande'] = pd.to_datetime(df_csv['date_commande'])
-        df_csv['commande_key'] = df_csv['numero_commande'] + '_' + df_csv['date_commande'].dt.strftime('%Y%m%d')
-        commande_mapping = {key: idx + 1 for idx, key in enumerate(df_csv['commande_key'].unique())}
-        df_csv['commande_id'] = df_csv['commande_key'].map(commande_mapping)
-
-        # Charger les commandes
-        commandes = df_csv[['commande_id', 'numero_commande', 'date_commande', 'revendeur_id']].drop_duplicates()
-        commandes = validate_dataframe(commandes, 'Commandes', 
-                                     ['commande_id', 'numero_commande', 'date_commande', 'revendeur_id'], 
-                                     'commande_id')
-        load_to_mysql_deduplicated(commandes, 'Commandes', engine, pk_column='commande_id')
-
-        # Charger les lignes de commande
-        lignes = df_csv[['commande_id', 'product_id', 'quantite', 'prix_unitaire_vente']].copy()
-        lignes['ligne_id'] = range(1, len(lignes) + 1)
-        lignes = lignes.rename(columns={'product_id': 'produit_id'})
-        lignes = validate_dataframe(lignes, 'LignesCommande', 
-                                  ['ligne_id', 'commande_id', 'produit_id', 'quantite'], 
-                                  'ligne_id')
-        load_to_mysql_deduplicated(lignes, 'LignesCommande', engine, pk_column='ligne_id')
-
-        # --- 7. Créer les mouvements de stock ---
-        commandes_mouvements = df_csv[['commande_id', 'numero_commande', 'date_commande', 'product_id', 'quantite']].rename(columns={'product_id': 'produit_id'})
-        create_mouvements_stock(engine, commandes_mouvements, productions_df)
+
+            # ID permanent par commande (numero_commande, date, revendeur) et par ligne
+            # (commande, produit, rang dans la commande) : stables d'une exécution à l'autre
+            commande_key = natural_key(df_csv, ['numero_commande', 'date_commande', 'revendeur_id'])
+            df_csv['commande_id'] = assign_surrogate_keys('commande', commande_key)
+            df_csv['rang'] = commande_key.groupby(commande_key, sort=False).cumcount() + 1
+            # Après une reprise, le rang prolonge les lignes déjà lues de chaque commande
+            line_counts = csv_line_counts(CSV_PATH)
+            df_csv['rang'] += commande_key.map(line_counts).fillna(0).astype(int)
+            update_line_counts(line_counts, commande_key, df_csv['rang'])
+            df_csv['ligne_id'] = assign_surrogate_keys(
+                'ligne', natural_key(df_csv.assign(commande_key=commande_key), ['commande_key', 'product_id', 'rang']))
+
+            # Charger les commandes
+            commandes = df_csv[['commande_id', 'numero_commande', 'date_commande', 'revendeur_id']].drop_duplicates()
+            commandes = validate_dataframe(commandes, 'Commandes', 
+                                         ['commande_id', 'numero_commande', 'date_commande', 'revendeur_id'], 
+                                         'commande_id')
+            load_to_mysql_deduplicated(commandes, 'Commandes', db, pk_column='commande_id')
+
+            # Charger les lignes de commande
+            lignes = df_csv[['ligne_id', 'commande_id', 'product_id', 'quantite', 'prix_unitaire_vente']].copy()
+            lignes = lignes.rename(columns={'product_id': 'produit_id'})
+            lignes = validate_dataframe(lignes, 'LignesCommande', 
+                                      ['ligne_id', 'commande_id', 'produit_id', 'quantite'], 
+                                      'ligne_id')
+            load_to_mysql_deduplicated(lignes, 'LignesCommande', db, pk_column='ligne_id')
+
+            # --- 7. Créer les mouvements de stock ---
+            # Pas de sortie de stock pour une ligne rejetée à la validation
+            df_csv = df_csv[df_csv['ligne_id'].isin(lignes['ligne_id'])]
+            commandes_mouvements = df_csv[['ligne_id', 'commande_id', 'numero_commande', 'date_commande', 'product_id', 'quantite']].rename(columns={'product_id': 'produit_id'})
+            create_mouvements_stock(db, commandes_mouvements, productions_df)
+
+        # Les high-water marks n'avancent qu'après un chargement réussi
+        save_watermarks()
+        save_csv_checkpoints()
 
         # --- 8. Générer les exports ---
         logging.info("📤 Génération des exports finaux...")
         sql_file = export_sql_complet()
         stock_file = export_etat_stocks(engine)
+        # Un export manquant doit être régénéré au prochain run : le manifeste n'avance pas
+        if sql_file and stock_file:
+            save_manifest(fingerprints)
+        else:
+            logging.warning("⚠️  Export incomplet : manifeste non enregistré, le prochain run ne sera pas sauté")
 
         # --- 9. Résumé final ---
         logging.info("=" * 50)
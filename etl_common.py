@@ -0,0 +1,910 @@
+"""Fonctions partagées par les scripts ETL (qwen2.py, distributech_etl_improved.py).
+
+Lecture des CSV de commandes (reprise, décompression en flux), cache de
+staging, extraction SQLite (lecture seule, high-water marks), écriture
+MySQL par lots et registre des clés de substitution. Leur configuration
+est déclarée ici ; chaque script importe les noms qu'il utilise.
+"""
+import pandas as pd
+import numpy as np
+import sqlite3
+import logging
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+import os
+import re
+import json
+import gzip
+import io
+import hashlib
+from contextlib import nullcontext, closing
+from pathlib import Path
+import tempfile
+import threading
+import time
+from run_manifest import file_stat
+
+# === CONFIGURATION ===
+# Lecture SQLite immuable (ni verrou ni détection de changement) : la base ne doit pas être modifiée pendant l'extraction
+SQLITE_IMMUTABLE = True
+SQLITE_MMAP_SIZE = 1024 ** 3
+WATERMARK_PATH = './data/watermarks.json'
+SQLITE_PAGE_SIZE = 50_000
+# Runs de reporting : production agrégée dans SQLite (SUM par produit et date), seuls les totaux partent vers MySQL
+PRODUCTION_PUSHDOWN = False
+# Table MySQL de la production lue par les rapports de stock (qwen2.py, generate_stock_csv.py)
+PRODUCTION_REPORT_TABLE = 'ProductionsJournalieres' if PRODUCTION_PUSHDOWN else 'Productions'
+# Points de reprise des CSV (offset, inode, empreintes par fichier)
+CSV_CHECKPOINT_PATH = './data/csv_checkpoints.json'
+# Registre local des ids permanents (clé naturelle -> id)
+KEY_REGISTRY_PATH = './data/key_registry.sqlite'
+NATURAL_KEY_SEPARATOR = '\x1f'
+# Ids déjà présents dans MySQL, relus pour amorcer un registre vide : entité -> (table, requête)
+REGISTRY_SEED_QUERIES = {
+    'commande': ('Commandes', "SELECT commande_id AS id, numero_commande, date_commande, revendeur_id FROM Commandes"),
+    'ligne': ('LignesCommande', "SELECT l.ligne_id AS id, l.produit_id, c.numero_commande, c.date_commande, "
+                                "c.revendeur_id FROM LignesCommande l "
+                                "LEFT JOIN Commandes c ON c.commande_id = l.commande_id ORDER BY l.ligne_id"),
+    'production': ('Productions', "SELECT production_id AS id FROM Productions"),
+    # Sortie : la ligne de même id et de même commande ; entrée : la production de la référence
+    'mouvement': ('MouvementsStock', "SELECT m.mouvement_id AS id, m.type_mouvement, m.reference, l.ligne_id "
+                                     "FROM MouvementsStock m LEFT JOIN LignesCommande l "
+                                     "ON m.type_mouvement = 'SORTIE' AND l.ligne_id = m.mouvement_id "
+                                     "AND l.commande_id = m.commande_id"),
+}
+# Entités dont une ligne MySQL sans clé reconstructible serait recréée en double : l'amorçage s'arrête
+REGISTRY_SEED_STRICT = {'mouvement'}
+# Clés cherchées par requête dans le registre (limite historique des paramètres SQLite)
+REGISTRY_LOOKUP_CHUNK = 999
+# Cache de pages SQLite pendant la recherche (Ko)
+REGISTRY_CACHE_KB = 65536
+# Lots d'écriture : taille initiale, puis ajustée pour viser cette latence par commit
+BATCH_INITIAL_ROWS = 1000
+BATCH_TARGET_SECONDS = 1.0
+# Session de chargement massif : commits groupés tous les BULK_COMMIT_ROWS
+BULK_COMMIT_ROWS = 500_000
+# Retirer puis reconstruire les index secondaires quand un lot dépasse cette fraction de la table (None = jamais)
+BULK_INDEX_RATIO = None
+
+# === SCHÉMA DU CSV DES COMMANDES ===
+# Types compacts déclarés une fois pour toutes : pas d'inférence pandas,
+# numero_commande en category (très répétitif), dates parsées une seule fois.
+# Entiers nullables : une cellule vide donne <NA> au lieu de faire échouer la lecture.
+CSV_DTYPES = {
+    'numero_commande': 'category',
+    'commande_date': 'str',
+    'revendeur_id': 'Int32',
+    'region_id': 'Int16',
+    'product_id': 'Int32',
+    'quantity': 'Int32',
+    'unit_price': 'float64',
+}
+CSV_DATE_FORMATS = {'commande_date': '%Y-%m-%d'}
+
+try:
+    import pyarrow
+    import pyarrow.feather as feather
+    CSV_ENGINE = 'pyarrow'
+except ImportError:
+    feather = None
+    CSV_ENGINE = 'c'
+
+# Cache de staging : frames extraites et typées (Arrow IPC, projetées en mémoire), par empreinte de la source
+STAGING_ENABLED = feather is not None
+STAGING_DIR = './data/staging'
+STAGING_MAX_BYTES = 2 * 1024 ** 3
+
+# Sources compressées reconnues à leurs octets magiques, décompressées en flux
+COMPRESSION_MAGIC = {'gzip': b'\x1f\x8b', 'zstd': b'\x28\xb5\x2f\xfd'}
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Taille de lot apprise par table, réutilisée d'un chargement à l'autre
+_batch_sizes = {}
+# High-water marks calculés pendant l'extraction, enregistrés après un chargement réussi
+_pending_watermarks = {}
+# Points de reprise des CSV lus, enregistrés après un chargement réussi
+_pending_csv_checkpoints = {}
+
+# === FONCTION : Créer les tables si elles n'existent pas ===
+def create_table_if_not_exists(engine, create_table_sql):
+    with engine.connect() as connection:
+        try:
+            connection.execute(text(create_table_sql))
+            connection.commit()
+            logging.info("✅ Table créée ou existe déjà")
+        except Exception as e:
+            logging.error(f"❌ Erreur lors de la création de la table : {e}")
+            raise
+
+
+# === FONCTION : Typer les dates du CSV ===
+def parse_csv_dates(df):
+    """Convertit les colonnes date du CSV avec leur format fixe (un seul parsing)"""
+    for col, fmt in CSV_DATE_FORMATS.items():
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], format=fmt)
+    return df
+
+
+# === FONCTION : Lire / écrire les points de reprise CSV ===
+def load_csv_checkpoints(path=CSV_CHECKPOINT_PATH):
+    """Points de reprise enregistrés par fichier CSV ({} au premier passage)"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_csv_checkpoints(path=CSV_CHECKPOINT_PATH):
+    """Enregistre les points de reprise des CSV lus, une fois le chargement réussi (fichier inchangé s'ils n'ont pas bougé)"""
+    if not _pending_csv_checkpoints:
+        return
+    checkpoints = load_csv_checkpoints(path)
+    if all(checkpoints.get(p) == c for p, c in _pending_csv_checkpoints.items()):
+        _pending_csv_checkpoints.clear()
+        return
+    checkpoints.update(_pending_csv_checkpoints)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoints, f)
+    os.replace(tmp_path, path)
+    offsets = ', '.join(f"{os.path.basename(p)}@{c['offset']}" for p, c in _pending_csv_checkpoints.items())
+    logging.info(f"💾 Points de reprise CSV enregistrés : {offsets}")
+    _pending_csv_checkpoints.clear()
+
+
+def csv_staging_key(path, header, start, end, dtypes=CSV_DTYPES):
+    """Clé de cache des lignes lues : empreinte de l'en-tête et des octets [start, end), schéma de lecture"""
+    if not STAGING_ENABLED:
+        return None
+    # Source compressée (end=None) : empreinte du fichier entier, position de reprise dans la clé
+    digest = hash_file(path, prefix=header) if end is None else hash_file(path, start, end, header)
+    return staging_key('csv', digest, start, dtypes, CSV_DATE_FORMATS)
+
+
+def csv_line_counts(path):
+    """Lignes déjà vues de la dernière commande du fichier (prolonge le rang des lignes après une reprise)"""
+    checkpoint = _pending_csv_checkpoints.get(os.path.abspath(path))
+    return checkpoint['line_counts'] if checkpoint else {}
+
+
+def update_line_counts(line_counts, commande_key, rang):
+    """Remplace `line_counts` par le rang atteint de la dernière commande lue.
+
+    Les lignes d'une commande se suivent dans le fichier : seule la dernière
+    commande peut encore recevoir des lignes ajoutées, les autres sont
+    oubliées et le point de reprise garde une taille constante.
+    """
+    if commande_key.empty:
+        return
+    last = commande_key.iloc[-1]
+    line_counts.clear()
+    line_counts[last] = int(rang[commande_key == last].max())
+
+
+# === FONCTION : Fin des lignes complètes ===
+def complete_lines_end(f, size):
+    """Position juste après le dernier saut de ligne avant `size` (une ligne en cours d'écriture n'est pas lue)"""
+    pos = size
+    while pos > 0:
+        start = max(0, pos - 65536)
+        f.seek(start)
+        newline = f.read(pos - start).rfind(b'\n')
+        if newline >= 0:
+            return start + newline + 1
+        pos = start
+    return 0
+
+
+# === FONCTION : Détecter la compression ===
+def detect_compression(path):
+    """'gzip', 'zstd' ou None d'après les octets magiques du fichier (l'extension n'est pas consultée)"""
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    for compression, signature in COMPRESSION_MAGIC.items():
+        if magic.startswith(signature):
+            return compression
+    return None
+
+
+# === FONCTION : Ouvrir une source, décompressée à la volée ===
+def open_source(path):
+    """Flux binaire du contenu du fichier, décompressé au fil de la lecture (sans fichier temporaire)"""
+    compression = detect_compression(path)
+    if compression == 'gzip':
+        return gzip.open(path, 'rb')
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError(f"❌ '{path}' est compressé en zstd : le paquet zstandard est requis")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True))
+    return open(path, 'rb')
+
+
+def skip_bytes(f, n):
+    """Avance un flux décompressé de `n` octets (lus puis abandonnés : pas de saut possible)"""
+    while n > 0:
+        data = f.read(min(n, 1 << 20))
+        if not data:
+            return
+        n -= len(data)
+
+
+class CsvTail(io.RawIOBase):
+    """Flux binaire : ligne d'en-tête du CSV suivie des octets [start, end) du fichier.
+
+    Avec end=None (source compressée, taille décompressée inconnue), la
+    lecture va jusqu'à la fin du flux et `checkpoint` est complété à la
+    fermeture (offset et dernière ligne consommée).
+    """
+
+    def __init__(self, f, header, start, end, checkpoint=None):
+        self._f = f
+        self._header = header
+        self._start = start
+        self._remaining = None if end is None else end - start
+        self._checkpoint = checkpoint
+        self._read = 0
+        self._tail = b''
+        if f.seekable():
+            f.seek(start)
+        else:
+            skip_bytes(f, start)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._header:
+            n = min(len(buffer), len(self._header))
+            buffer[:n] = self._header[:n]
+            self._header = self._header[n:]
+            return n
+        if self._remaining is None:
+            data = self._f.read(len(buffer))
+            self._read += len(data)
+            self._tail = (self._tail + data)[-65536:]
+        else:
+            data = self._f.read(min(len(buffer), self._remaining))
+            self._remaining -= len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed and self._checkpoint is not None and self._read:
+            end = self._start + self._read
+            last_line = self._tail[self._tail.rstrip(b'\n').rfind(b'\n') + 1:]
+            self._checkpoint.update(offset=end, last_line_start=end - len(last_line),
+                                    last_line_sha1=hashlib.sha1(last_line).hexdigest())
+        self._f.close()
+        super().close()
+
+
+# === FONCTION : Reprise de lecture du CSV ===
+def csv_tail_range(path, incremental=True):
+    """Plage d'octets à lire depuis le dernier octet consommé : (ligne d'en-tête, début, fin).
+
+    Le point de reprise (inode, offset, empreintes de l'en-tête et de la
+    dernière ligne consommée) n'est suivi que s'il décrit toujours le
+    fichier : rotation, troncature ou réécriture font relire le fichier
+    entier. Seules les lignes complètes sont lues ; le nouveau point de
+    reprise est mis en attente jusqu'à save_csv_checkpoints().
+    """
+    key = os.path.abspath(path)
+    stat = os.stat(path)
+    compressed = detect_compression(path) is not None
+    with open_source(path) as f:
+        header = f.readline()
+        header_sha1 = hashlib.sha1(header).hexdigest()
+        checkpoint = load_csv_checkpoints().get(key) if incremental else None
+
+        start, line_counts = len(header), {}
+        if checkpoint:
+            if checkpoint['inode'] != stat.st_ino:
+                logging.warning(f"⚠️  '{path}' a été remplacé (rotation) : relecture complète")
+            elif not compressed and stat.st_size < checkpoint['offset']:
+                logging.warning(f"⚠️  '{path}' a été tronqué : relecture complète")
+            elif checkpoint['header_sha1'] != header_sha1:
+                logging.warning(f"⚠️  En-tête de '{path}' modifié : relecture complète")
+            else:
+                if compressed:
+                    # Une source compressée tronquée donne une dernière ligne différente
+                    skip_bytes(f, checkpoint['last_line_start'] - len(header))
+                else:
+                    f.seek(checkpoint['last_line_start'])
+                last_line = f.read(checkpoint['offset'] - checkpoint['last_line_start'])
+                if hashlib.sha1(last_line).hexdigest() == checkpoint['last_line_sha1']:
+                    start, line_counts = checkpoint['offset'], checkpoint['line_counts']
+                    new_bytes = 'source compressée' if compressed else f"{stat.st_size - start} octets nouveaux"
+                    logging.info(f"⏩ Reprise de '{path}' à l'octet {start} ({new_bytes})")
+                else:
+                    logging.warning(f"⚠️  '{path}' réécrit avant l'octet {checkpoint['offset']} : relecture complète")
+
+        # Taille décompressée inconnue : lecture jusqu'à la fin, point de reprise complété par CsvTail
+        end = None if compressed else max(complete_lines_end(f, stat.st_size), start)
+        if end is not None and end > start:
+            last_line_start = max(complete_lines_end(f, end - 1), len(header))
+            f.seek(last_line_start)
+            last_line_sha1 = hashlib.sha1(f.read(end - last_line_start)).hexdigest()
+        elif start > len(header):
+            # Rien de nouveau depuis la reprise : la dernière ligne consommée reste la même
+            last_line_start, last_line_sha1 = checkpoint['last_line_start'], checkpoint['last_line_sha1']
+        else:
+            last_line_start, last_line_sha1 = start, hashlib.sha1(b'').hexdigest()
+        _pending_csv_checkpoints[key] = {
+            'inode': stat.st_ino, 'offset': start if end is None else end, 'header_sha1': header_sha1,
+            'last_line_start': last_line_start, 'last_line_sha1': last_line_sha1,
+            'line_counts': line_counts,
+        }
+    return header, start, end
+
+
+def open_csv_range(path, header, start, end):
+    """Flux binaire bufferisé : en-tête puis octets [start, end) du contenu (décompressé) du fichier"""
+    checkpoint = _pending_csv_checkpoints.get(os.path.abspath(path)) if end is None else None
+    return io.BufferedReader(CsvTail(open_source(path), header, start, end, checkpoint), buffer_size=1 << 20)
+
+
+def open_csv_tail(path, incremental=True):
+    """Ouvre le CSV à partir du dernier octet consommé (flux binaire : en-tête + lignes non lues)"""
+    return open_csv_range(path, *csv_tail_range(path, incremental))
+
+
+# === FONCTION : Empreinte du contenu d'un fichier ===
+def hash_file(path, start=0, end=None, prefix=b''):
+    """Empreinte BLAKE2b de `prefix` puis des octets [start, end) du fichier (jusqu'à la fin si end=None)"""
+    digest = hashlib.blake2b(prefix, digest_size=16)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = float('inf') if end is None else end - start
+        while remaining > 0:
+            data = f.read(int(min(remaining, 1 << 20)))
+            if not data:
+                break
+            digest.update(data)
+            remaining -= len(data)
+    return digest.hexdigest()
+
+
+# === FONCTION : Empreinte d'une base SQLite ===
+def sqlite_digest(db_path):
+    """Empreinte de la base SQLite, sans relire ses données.
+
+    Taille, mtime et compteur de modifications de l'en-tête (incrémenté à
+    chaque transaction validée) du fichier principal ; taille et mtime du
+    journal WAL éventuel.
+    """
+    paths = [path for path in (db_path, db_path + '-wal') if os.path.exists(path)]
+    return repr([sorted(file_stat(path).items()) for path in paths])
+
+
+# === FONCTION : Cache de staging ===
+def staging_key(*parts):
+    """Clé de cache : empreinte de la source et des paramètres de lecture"""
+    return hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def read_staged(key):
+    """(frame, métadonnées) en cache pour `key`, ou (None, None).
+
+    Le fichier Arrow IPC est projeté en mémoire (memory_map) au lieu d'être
+    relu ; sa date de modification est rafraîchie pour l'éviction LRU. Une
+    entrée évincée entre-temps (autre processus) compte comme absente.
+    """
+    if key is None:
+        return None, None
+    path = os.path.join(STAGING_DIR, f"{key}.arrow")
+    try:
+        os.utime(path)
+        table = feather.read_table(path, memory_map=True)
+    except FileNotFoundError:
+        return None, None
+    meta = (table.schema.metadata or {}).get(b'etl')
+    logging.info(f"📦 Cache de staging réutilisé : {key} ({table.num_rows} lignes)")
+    return table.to_pandas(), json.loads(meta) if meta else None
+
+
+def write_staged(key, df, meta=None):
+    """Met df en cache (Arrow IPC non compressé, projetable en mémoire).
+
+    La limite de taille n'est pas appliquée ici : evict_staging() est appelé
+    une fois toutes les extractions terminées.
+    """
+    if key is None:
+        return
+    os.makedirs(STAGING_DIR, exist_ok=True)
+    path = os.path.join(STAGING_DIR, f"{key}.arrow")
+    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+    if meta is not None:
+        table = table.replace_schema_metadata({**table.schema.metadata, b'etl': json.dumps(meta)})
+    # Fichier temporaire propre au thread : deux extractions ne s'écrivent pas dessus
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+
+
+def evict_staging(max_bytes=STAGING_MAX_BYTES):
+    """Supprime les entrées les moins récemment utilisées tant que le cache dépasse `max_bytes`.
+
+    Les fichiers disparus entre-temps (autre processus) sont ignorés.
+    """
+    if not os.path.isdir(STAGING_DIR):
+        return
+    entries = []
+    for entry in os.scandir(STAGING_DIR):
+        if not entry.name.endswith('.arrow'):
+            continue
+        try:
+            entries.append((entry, entry.stat()))
+        except FileNotFoundError:
+            continue
+    entries.sort(key=lambda item: item[1].st_mtime)
+    total = sum(stat.st_size for _, stat in entries)
+    for entry, stat in entries:
+        if total <= max_bytes:
+            break
+        total -= stat.st_size
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            continue
+        logging.info(f"🧹 Cache de staging : {entry.name} évincé")
+
+
+# === FONCTION : Lire / écrire les high-water marks ===
+def load_watermarks(path=WATERMARK_PATH):
+    """High-water marks enregistrés par table ({} au premier passage)"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_watermarks(path=WATERMARK_PATH):
+    """Enregistre les high-water marks des extractions incrémentales, une fois le chargement réussi"""
+    if not _pending_watermarks:
+        return
+    watermarks = load_watermarks(path)
+    watermarks.update(_pending_watermarks)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(watermarks, f, indent=2)
+    os.replace(tmp_path, path)
+    marks = ', '.join(f"{table}={mark['value']}" for table, mark in _pending_watermarks.items())
+    logging.info(f"💾 High-water marks enregistrés : {marks}")
+    _pending_watermarks.clear()
+
+
+# === FONCTION : Pagination par clé ===
+def iter_keyset_pages(conn, table, column, after=None, page_size=SQLITE_PAGE_SIZE):
+    """Parcourt `table` par pages de `page_size` lignes : WHERE column > dernière valeur vue ORDER BY column"""
+    while True:
+        if after is None:
+            page = pd.read_sql(f"SELECT * FROM {table} ORDER BY {column} LIMIT ?", conn, params=(page_size,))
+        else:
+            page = pd.read_sql(f"SELECT * FROM {table} WHERE {column} > ? ORDER BY {column} LIMIT ?",
+                               conn, params=(after, page_size))
+        if page.empty:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        after = page[column].iloc[-1].item()
+
+
+# === FONCTION : Signature du contenu déjà extrait ===
+def watermark_signature(conn, table, column, value):
+    """Nombre de lignes jusqu'au high-water mark et empreinte de la ligne du mark (détection des réécritures)"""
+    count = conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {column} <= ?", (value,)).fetchone()[0]
+    row = conn.execute(f"SELECT * FROM {table} WHERE {column} = ?", (value,)).fetchone()
+    return count, hashlib.sha1(repr(row).encode('utf-8')).hexdigest()
+
+
+# === FONCTION : Extraction incrémentale ===
+def extract_incremental(conn, table, column):
+    """Extrait les lignes au-delà du high-water mark de `table` (colonne monotone `column`).
+
+    Si les lignes déjà extraites ont changé (suppression, réécriture, base
+    reconstruite), le mark est ignoré et la table relue entièrement. Le
+    nouveau mark est mis en attente jusqu'à save_watermarks().
+    """
+    after = incremental_after(conn, table, column)
+    df = concat_pages(conn, table, iter_keyset_pages(conn, table, column, after))
+    if not df.empty:
+        pend_watermark(conn, table, column, df[column].iloc[-1].item())
+    mode = 'complète' if after is None else f"{column} > {after}"
+    logging.info(f"✅ Table '{table}' (incrémentale, {mode}) : {len(df)} lignes")
+    return df
+
+
+# === FONCTION : Point de reprise d'une extraction incrémentale ===
+def incremental_after(conn, table, column):
+    """High-water mark de `table` encore valide, ou None si la table doit être relue entièrement"""
+    mark = load_watermarks().get(table)
+    if not mark or mark['column'] != column:
+        return None
+    count, checksum = watermark_signature(conn, table, column, mark['value'])
+    if (count, checksum) != (mark['count'], mark['checksum']):
+        logging.warning(f"⚠️  Réécriture détectée dans '{table}' sous le mark {mark['value']} : relecture complète")
+        return None
+    return mark['value']
+
+
+# === FONCTION : Mettre en attente un high-water mark ===
+def pend_watermark(conn, table, column, value):
+    """Met en attente le mark `value` de `table` et sa signature jusqu'à save_watermarks()"""
+    count, checksum = watermark_signature(conn, table, column, value)
+    _pending_watermarks[table] = {'column': column, 'value': value, 'count': count, 'checksum': checksum}
+
+
+# === FONCTION : Connexion SQLite en lecture seule ===
+def sqlite_readonly(db_path):
+    """Connexion SQLite en lecture seule (mode=ro, immutable, mmap_size élevé) : une par thread d'extraction"""
+    uri = f"{Path(db_path).resolve().as_uri()}?mode=ro"
+    # immutable=1 ignorerait un journal WAL non encore reporté dans la base
+    if SQLITE_IMMUTABLE and not os.path.exists(db_path + '-wal'):
+        uri += '&immutable=1'
+    conn = sqlite3.connect(uri, uri=True)
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    return conn
+
+
+# === FONCTION : Pages d'une table SQLite ===
+def iter_table_pages(db_path, table, column, after=None, page_size=SQLITE_PAGE_SIZE):
+    """Générateur de pages de `page_size` lignes de `table` (pagination sur `column`), sur sa propre connexion.
+
+    La mémoire reste bornée par la taille de page, quel que soit le volume de la table.
+    """
+    with closing(sqlite_readonly(db_path)) as conn:
+        yield from iter_keyset_pages(conn, table, column, after, page_size)
+
+
+# === FONCTION : Assembler les pages d'une table ===
+def concat_pages(conn, table, pages):
+    """Assemble des pages en une frame (frame vide aux colonnes de la table s'il n'y en a aucune)"""
+    pages = list(pages)
+    return pd.concat(pages, ignore_index=True) if pages else pd.read_sql(f"SELECT * FROM {table} LIMIT 0", conn)
+
+
+# === FONCTION : Connexion épinglée ou engine ===
+def connect(engine):
+    """engine.connect(), ou la connexion elle-même si l'on reçoit une connexion épinglée"""
+    return nullcontext(engine) if isinstance(engine, Connection) else engine.connect()
+
+
+# === FONCTION : Validation des écritures ===
+def commit(conn, rows=0):
+    """Valide la transaction ; en session de chargement massif, seulement tous les BULK_COMMIT_ROWS"""
+    session = conn.info.get('bulk_session')
+    if session is None:
+        conn.commit()
+        return
+    session['pending'] += rows
+    if session['pending'] >= BULK_COMMIT_ROWS:
+        conn.commit()
+        session['pending'] = 0
+
+
+# === FONCTION : Fichier au format LOAD DATA ===
+def write_load_data_file(df, path):
+    """Écrit le lot au format texte par défaut de LOAD DATA : tabulations, NULL = \\N, dates ISO"""
+    text_cols = {}
+    for col in df.columns:
+        if df[col].dtype == 'object' or isinstance(df[col].dtype, (pd.CategoricalDtype, pd.StringDtype)):
+            values = df[col].astype(object)
+            text_cols[col] = values.where(values.isna(), values.astype(str)
+                                          .str.replace('\\', '\\\\', regex=False)
+                                          .str.replace('\t', '\\t', regex=False)
+                                          .str.replace('\n', '\\n', regex=False))
+    df.assign(**text_cols).to_csv(
+        path, sep='\t', header=False, index=False, na_rep='\\N',
+        date_format='%Y-%m-%d %H:%M:%S', lineterminator='\n', encoding='utf-8'
+    )
+
+
+# === FONCTION : Chargement massif LOAD DATA LOCAL INFILE ===
+def bulk_load_infile(conn, df, table_name, index_as_pk=False):
+    """Charge le DataFrame dans `table_name` via LOAD DATA LOCAL INFILE (fichier temporaire).
+
+    Nécessite `allow_local_infile` côté client et `local_infile=ON` côté serveur.
+    LOCAL implique IGNORE : conversions, troncatures et NOT NULL ne sont que
+    des avertissements : s'il y en a, une erreur est levée comme le ferait un
+    INSERT. Retourne le nombre de lignes chargées.
+    """
+    if index_as_pk:
+        df = df.reset_index()
+    fd, path = tempfile.mkstemp(prefix=f"{table_name}_", suffix='.tsv')
+    os.close(fd)
+    try:
+        write_load_data_file(df, path)
+        cols = ", ".join(f"`{c}`" for c in df.columns)
+        result = conn.execute(
+            text(f"LOAD DATA LOCAL INFILE :path INTO TABLE `{table_name}` CHARACTER SET utf8mb4 ({cols})"),
+            {'path': path.replace(os.sep, '/')}
+        )
+        warning_count = conn.execute(text("SELECT @@warning_count")).scalar()
+        if warning_count:
+            details = "; ".join(row[2] for row in conn.execute(text("SHOW WARNINGS LIMIT 5")))
+            raise ValueError(f"❌ LOAD DATA dans '{table_name}' : {warning_count} avertissements "
+                             f"(valeurs converties, tronquées ou rejetées) : {details}")
+        return result.rowcount
+    finally:
+        os.remove(path)
+
+
+# === FONCTION : Dédoublonnage côté serveur ===
+def insert_missing_keys(conn, df, table_name, pk_column, dtype_mapping=None, index_as_pk=False, bulk=False):
+    """Insère uniquement les lignes dont la clé est absente de la table.
+
+    Le lot est chargé dans une table temporaire (même structure que la cible)
+    puis recopié par anti-jointure : MySQL ne compare que les clés du lot, le
+    coût dépend de la taille du lot et non de celle de la table. Avec `bulk`,
+    la table temporaire est remplie par LOAD DATA LOCAL INFILE.
+    Retourne le nombre de lignes insérées.
+    """
+    # Nom en minuscules : to_sql ne signale pas de conflit de casse (check_case_sensitive) à chaque lot
+    stage = f"_stage_{table_name.lower()}"
+    columns = ([df.index.name or 'index'] if index_as_pk else []) + list(df.columns)
+    cols = ", ".join(f"`{c}`" for c in columns)
+    stage_cols = ", ".join(f"s.`{c}`" for c in columns)
+
+    conn.execute(text(f"DROP TEMPORARY TABLE IF EXISTS `{stage}`"))
+    conn.execute(text(f"CREATE TEMPORARY TABLE `{stage}` LIKE `{table_name}`"))
+    try:
+        if bulk:
+            bulk_load_infile(conn, df, stage, index_as_pk)
+        else:
+            to_sql_batched(df, stage, conn, index_as_pk, dtype_mapping)
+        result = conn.execute(text(
+            f"INSERT INTO `{table_name}` ({cols}) "
+            f"SELECT {stage_cols} FROM `{stage}` s "
+            f"LEFT JOIN `{table_name}` t ON t.`{pk_column}` = s.`{pk_column}` "
+            f"WHERE t.`{pk_column}` IS NULL"
+        ))
+        return result.rowcount
+    finally:
+        conn.execute(text(f"DROP TEMPORARY TABLE IF EXISTS `{stage}`"))
+
+
+# === FONCTION : Taille des lots selon max_allowed_packet ===
+def rows_per_packet(conn, df, fill_ratio=0.5):
+    """Nombre de lignes par INSERT multi-lignes pour rester sous max_allowed_packet"""
+    packet = int(conn.execute(text("SELECT @@max_allowed_packet")).scalar())
+    sample = df.head(1000)
+    if sample.empty:
+        return 1
+    # Taille texte d'une ligne, doublée pour les quotes, virgules et parenthèses du VALUES
+    row_bytes = 2 * len(sample.to_csv(index=False, header=False).encode('utf-8')) / len(sample)
+    return max(1, int(packet * fill_ratio // row_bytes))
+
+
+# === FONCTION : Écriture par lots adaptatifs ===
+def to_sql_batched(df, table_name, conn, index_as_pk=False, dtype=None, method=None):
+    """Écrit df par lots multi-lignes, un commit par lot.
+
+    La taille de départ est celle apprise au précédent appel pour la table,
+    plafonnée par max_allowed_packet ; elle double tant qu'un lot (commit
+    compris) prend moins de la moitié de BATCH_TARGET_SECONDS et est divisée
+    par deux au-delà du double. Retourne le nombre de lignes affectées.
+    """
+    max_rows = rows_per_packet(conn, df)
+    size = min(_batch_sizes.get(table_name, BATCH_INITIAL_ROWS), max_rows)
+    done = 0
+    affected = 0
+    while done < len(df):
+        batch = df.iloc[done:done + size]
+        started = time.perf_counter()
+        result = batch.to_sql(table_name, con=conn, if_exists='append', index=index_as_pk,
+                              dtype=dtype, method=method)
+        commit(conn, len(batch))
+        elapsed = time.perf_counter() - started
+        done += len(batch)
+        affected += len(batch) if result is None else result
+
+        if elapsed < BATCH_TARGET_SECONDS / 2:
+            size = min(size * 2, max_rows)
+        elif elapsed > BATCH_TARGET_SECONDS * 2:
+            size = max(1, size // 2)
+    _batch_sizes[table_name] = size
+    logging.info(f"📏 '{table_name}' : {done} lignes écrites, lots de {size} lignes (max paquet : {max_rows})")
+    return affected
+
+
+# === FONCTION : Upsert par lots ===
+def upsert_rows(conn, df, table_name, pk_column, update_columns=None, index_as_pk=False):
+    """INSERT ... ON DUPLICATE KEY UPDATE multi-lignes, par lots adaptatifs (to_sql_batched).
+
+    Seules les colonnes `update_columns` (par défaut toutes sauf la clé) sont
+    mises à jour ; MySQL ne réécrit pas une ligne dont les valeurs sont
+    identiques, une correction ne coûte donc que les lignes modifiées.
+    Retourne le nombre de lignes affectées (1 par insertion, 2 par mise à jour).
+    """
+    if update_columns is None:
+        update_columns = [c for c in df.columns if c != pk_column]
+
+    def on_duplicate_key_update(pd_table, conn, keys, data_iter):
+        stmt = mysql_insert(pd_table.table).values([dict(zip(keys, row)) for row in data_iter])
+        stmt = stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in update_columns})
+        return conn.execute(stmt).rowcount
+
+    return to_sql_batched(df, table_name, conn, index_as_pk, method=on_duplicate_key_update)
+
+
+# === FONCTION : Faut-il retirer les index ? ===
+def use_bulk_index(conn, table_name, rows):
+    """Vrai si le lot dépasse BULK_INDEX_RATIO fois la taille (estimée) de la table.
+
+    Toujours faux dans une session de chargement massif : les ALTER TABLE qui
+    retirent et reconstruisent les index y valideraient implicitement la
+    transaction en cours (commit par lots et rollback perdus).
+    """
+    if BULK_INDEX_RATIO is None or conn.info.get('bulk_session') is not None:
+        return False
+    table_rows = conn.execute(text(
+        "SELECT TABLE_ROWS FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"
+    ), {'table': table_name}).scalar() or 0
+    return rows > BULK_INDEX_RATIO * table_rows
+
+
+# === FONCTION : Index couvrant une clé étrangère ===
+def index_covers(index_columns, fk_columns):
+    """Vrai si l'index (liste de colonnes de SHOW CREATE TABLE) commence par les colonnes de la FK"""
+    index = re.findall(r"`([^`]+)`", index_columns)
+    fk = re.findall(r"`([^`]+)`", fk_columns)
+    return index[:len(fk)] == fk
+
+
+# === FONCTION : Clé naturelle ===
+def natural_key(df, columns):
+    """Concatène les colonnes d'une clé naturelle en une chaîne stable (dates au format ISO)"""
+    parts = []
+    for col in columns:
+        values = df[col]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            values = values.dt.strftime('%Y-%m-%d %H:%M:%S')
+        parts.append(values.astype(str))
+    key = parts[0]
+    for part in parts[1:]:
+        key = key + NATURAL_KEY_SEPARATOR + part
+    return key
+
+
+# === FONCTION : Table du registre d'une entité ===
+def create_registry(conn, entity):
+    """Crée la table clé naturelle -> id de l'entité dans le registre SQLite"""
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {entity} "
+                 f"(natural_key TEXT PRIMARY KEY, id INTEGER NOT NULL UNIQUE) WITHOUT ROWID")
+
+
+# === FONCTION : Clé d'un mouvement de stock ===
+def mouvement_key(type_mouvement, source_id):
+    """Clé entière d'un mouvement : source_id * 2 + type (0 = SORTIE, 1 = ENTREE), en texte pour le registre
+
+    source_id est la ligne de commande d'une sortie, la production d'une
+    entrée ; une source inconnue (NA) donne une clé manquante.
+    """
+    key = source_id.astype('Int64') * 2 + (type_mouvement == 'ENTREE').astype('Int64')
+    return key.astype(str).where(key.notna())
+
+
+# === FONCTION : Registre des clés de substitution ===
+def assign_surrogate_keys(entity, keys, registry_path=KEY_REGISTRY_PATH):
+    """Retourne les ids permanents des clés naturelles `keys` (Series int64 alignée sur `keys`).
+
+    Le registre SQLite local garde une table par entité (clé naturelle -> id).
+    Seules les clés du lot y sont cherchées (IN par paquets de
+    REGISTRY_LOOKUP_CHUNK) : le coût suit la taille du lot, pas l'historique
+    du registre. Les inconnues reçoivent les ids suivant le MAX(id) attribué
+    et sont enregistrées en un seul lot. Un même objet garde le même id d'une
+    exécution à l'autre ; une clé manquante (NA) n'a pas d'id (Series Int64).
+    """
+    codes, uniques = pd.factorize(keys)
+    uniques = uniques.tolist()
+    conn = sqlite3.connect(registry_path)
+    try:
+        with conn:
+            create_registry(conn, entity)
+            conn.execute(f"PRAGMA cache_size = -{REGISTRY_CACHE_KB}")
+            # Clés triées : les requêtes successives parcourent l'index dans l'ordre
+            lookup = sorted(uniques)
+            known = {}
+            for start in range(0, len(lookup), REGISTRY_LOOKUP_CHUNK):
+                chunk = lookup[start:start + REGISTRY_LOOKUP_CHUNK]
+                known.update(conn.execute(
+                    f"SELECT natural_key, id FROM {entity} WHERE natural_key IN ({', '.join('?' * len(chunk))})", chunk
+                ))
+            missing = [key for key in uniques if key not in known]
+            next_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {entity}").fetchone()[0]
+            new_ids = dict(zip(missing, range(next_id, next_id + len(missing))))
+            conn.executemany(f"INSERT INTO {entity} (natural_key, id) VALUES (?, ?)", new_ids.items())
+    finally:
+        conn.close()
+    if new_ids:
+        logging.info(f"🔑 Registre '{entity}' : {len(new_ids)} nouveaux ids ({len(known)} déjà connus)")
+    known.update(new_ids)
+    # codes de factorize : position de chaque clé dans `uniques`, -1 pour une clé manquante
+    ids = np.array([known[key] for key in uniques] + [0], dtype='int64')[codes]
+    if (codes < 0).any():
+        return pd.Series(pd.arrays.IntegerArray(ids, codes < 0), index=keys.index)
+    return pd.Series(ids, index=keys.index)
+
+
+# === FONCTION : Clés naturelles des lignes déjà chargées ===
+def registry_seed_keys(entity, existing):
+    """Reconstruit les clés naturelles des lignes relues dans MySQL (None si l'entité n'en a pas)
+
+    Les clés doivent être identiques à celles calculées depuis les sources :
+    le rang d'une ligne dans sa commande suit l'ordre des ligne_id, attribués
+    dans l'ordre du fichier. Avant le registre, la sortie de stock n° i était
+    celle de la ligne i et une entrée portait la référence 'PROD-<production_id>'.
+    """
+    if entity in ('commande', 'ligne'):
+        # Mêmes types que le CSV typé : entiers sans '.0' (NULL après LEFT JOIN), dates datetime64
+        existing = existing.astype({col: 'Int64' for col in ('revendeur_id', 'produit_id') if col in existing})
+        existing['date_commande'] = pd.to_datetime(existing['date_commande'])
+    if entity == 'commande':
+        return natural_key(existing, ['numero_commande', 'date_commande', 'revendeur_id'])
+    if entity == 'ligne':
+        commande_key = natural_key(existing, ['numero_commande', 'date_commande', 'revendeur_id'])
+        rang = commande_key.groupby(commande_key, sort=False, dropna=False).cumcount() + 1
+        key = natural_key(existing.assign(commande_key=commande_key, rang=rang), ['commande_key', 'produit_id', 'rang'])
+        # Ligne orpheline : pas de commande pour reconstruire la clé
+        return key.mask(existing['numero_commande'].isna())
+    if entity == 'production':
+        return natural_key(existing, ['id'])
+    if entity == 'mouvement':
+        production_id = pd.to_numeric(existing['reference'].str.extract(r'^PROD-(\d+)$', expand=False), errors='coerce')
+        source_id = existing['ligne_id'].where(existing['type_mouvement'] == 'SORTIE', production_id)
+        return mouvement_key(existing['type_mouvement'], source_id)
+    return None
+
+
+# === FONCTION : Amorcer les registres depuis MySQL ===
+def seed_key_registries(engine, entities, registry_path=KEY_REGISTRY_PATH):
+    """Amorce les registres encore vides avec les ids déjà chargés dans MySQL.
+
+    À appeler avant la première attribution : sans cela un registre neuf
+    repartirait de 1 et réattribuerait des ids existants. Une ligne dont la
+    clé ne se reconstruit pas (ou en double) réserve seulement son id, sauf
+    pour les entités de REGISTRY_SEED_STRICT où l'amorçage échoue ; les
+    registres déjà remplis ne sont pas relus.
+    """
+    registry = sqlite3.connect(registry_path)
+    try:
+        with registry, connect(engine) as conn:
+            for entity in entities:
+                create_registry(registry, entity)
+                if registry.execute(f"SELECT 1 FROM {entity} LIMIT 1").fetchone():
+                    continue
+                table, query = REGISTRY_SEED_QUERIES[entity]
+                exists = conn.execute(text(
+                    "SELECT COUNT(*) FROM information_schema.TABLES "
+                    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"
+                ), {'table': table}).scalar()
+                existing = pd.read_sql(text(query), conn) if exists else None
+                if existing is None or existing.empty:
+                    continue
+                keys = registry_seed_keys(entity, existing)
+                if keys is None:
+                    keys = pd.Series(None, index=existing.index, dtype=object)
+                if entity in REGISTRY_SEED_STRICT and keys.isna().any():
+                    raise ValueError(
+                        f"❌ {int(keys.isna().sum())} lignes de {table} sans clé reconstructible : elles seraient "
+                        f"recréées sous de nouveaux ids. Vider {table}, supprimer {CSV_CHECKPOINT_PATH} et {WATERMARK_PATH} "
+                        f"(rechargement complet) puis relancer."
+                    )
+                reserved = keys.isna() | keys.duplicated()
+                placeholder = NATURAL_KEY_SEPARATOR + 'mysql' + NATURAL_KEY_SEPARATOR + existing['id'].astype(str)
+                keys = keys.where(~reserved, placeholder)
+                registry.executemany(f"INSERT INTO {entity} (natural_key, id) VALUES (?, ?)",
+                                     zip(keys, existing['id'].astype(int).tolist()))
+                logging.info(f"🔑 Registre '{entity}' amorcé depuis {table} : {len(existing)} ids "
+                             f"({int(reserved.sum())} seulement réservés)")
+    finally:
+        registry.close()
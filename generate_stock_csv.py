@@ -3,6 +3,7 @@ import pandas as pd
 import mysql.connector
 import logging
 import os
+from etl_common import PRODUCTION_REPORT_TABLE
 
 # --- Configuration MySQL ---
 MYSQL_USER = 'appuser'
@@ -36,7 +37,7 @@ def generate_stock_report_csv():
         if conn.is_connected():
             logging.info("Connexion à la base de données MySQL établie.")
             
-            query = """
+            query = f"""
             SELECT
                 p.produit_id,
                 p.nom_produit,
@@ -44,7 +45,7 @@ def generate_stock_report_csv():
             FROM
                 Produits p
             JOIN
-                Productions prod ON p.produit_id = prod.product_id
+                {PRODUCTION_REPORT_TABLE} prod ON p.produit_id = prod.product_id
             GROUP BY
                 p.produit_id, p.nom_produit
             ORDER BY
@@ -1,11 +1,32 @@
 import pandas as pd
+import numpy as np
 import sqlite3
 import logging
-from sqlalchemy import create_engine, types, text
+from sqlalchemy import create_engine, types, text, bindparam
 import os
 import mysql.connector
 from datetime import datetime
 import subprocess
+import json
+import io
+from contextlib import contextmanager, nullcontext, closing
+import re
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+import glob
+import mmap
+import multiprocessing
+from itertools import repeat
+import time
+from etl_common import (
+    CSV_DTYPES, CSV_DATE_FORMATS, CSV_ENGINE, STAGING_ENABLED, BATCH_INITIAL_ROWS, _pending_csv_checkpoints,
+    PRODUCTION_PUSHDOWN, PRODUCTION_REPORT_TABLE,
+    create_table_if_not_exists, parse_csv_dates, csv_tail_range, open_csv_range, open_csv_tail,
+    csv_line_counts, update_line_counts, csv_staging_key, save_csv_checkpoints, sqlite_digest, staging_key, read_staged,
+    write_staged, evict_staging, sqlite_readonly, iter_keyset_pages, iter_table_pages, concat_pages, extract_incremental,
+    incremental_after, pend_watermark, save_watermarks, connect, commit, insert_missing_keys, to_sql_batched, upsert_rows, use_bulk_index,
+    index_covers, natural_key, assign_surrogate_keys, seed_key_registries,
+)
 
 # === CONFIGURATION ===
 MYSQL_USER = 'appuser'
@@ -15,14 +36,115 @@ MYSQL_PORT = '3307'
 MYSQL_DB = 'distributech_db'
 
 SQLITE_DB_PATH = './data/base_stock.sqlite'
+# Tables SQLite lues par le pipeline : {table: clé primaire} (sqlite_sequence et tables internes ignorées)
+SQLITE_TABLES = {'region': 'region_id', 'revendeur': 'revendeur_id', 'produit': 'product_id', 'production': 'production_id'}
+# Capture des changements côté SQLite (triggers -> _etl_changelog) pour les tables de dimension
+SQLITE_CDC = False
+SQLITE_CDC_TABLES = ('region', 'revendeur', 'produit')
+# Runs de reporting, production agrégée dans SQLite : etl_common.PRODUCTION_PUSHDOWN (partagé avec generate_stock_csv.py)
+# Lecture complète de la production (premier run, mark invalidé, chargement fantôme) chargée page par page
+PRODUCTION_PAGED = True
+# Tables SQLite extraites de façon incrémentale : {table: colonne monotone}
+INCREMENTAL_TABLES = {'production': 'production_id'}
+# Threads d'extraction : une connexion SQLite en lecture seule par table, le CSV dans son propre thread
+EXTRACT_WORKERS = 4
 CSV_PATH = 'commande_revendeur_tech_express.csv'
+# Reprise de la lecture du CSV au dernier octet consommé (points de reprise : etl_common.CSV_CHECKPOINT_PATH)
+CSV_CHECKPOINT = True
+CSV_CHUNKSIZE = None  # ex. 100_000 : lecture du CSV en flux, bloc par bloc
+# Un fichier par revendeur : répertoire ou motif glob (remplace CSV_PATH), analysés en parallèle
+CSV_SOURCES = None  # ex. './data/commandes' ou './data/commandes/commande_revendeur_*.csv'
+CSV_WORKERS = os.cpu_count() or 1
+# Au-delà, un même fichier est analysé en plages d'octets parallèles (CSV_WORKERS processus)
+CSV_PARALLEL_MIN_BYTES = 256 * 1024 ** 2
+# Processus de travail démarrés sans fork du processus principal, dont les threads d'extraction tiennent connexions et verrous
+CSV_MP_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
 EXPORT_DIR = './exports'
+# Capture des changements : seules les lignes insérées / modifiées / supprimées depuis le dernier chargement partent vers MySQL
+CDC_ENABLED = False
+CDC_STORE_DIR = './data/cdc'
+# Tables chargées via LOAD DATA LOCAL INFILE plutôt que to_sql (ex. {'LignesCommande'})
+BULK_LOAD_TABLES = set()
+# Tables mises à jour par upsert (ON DUPLICATE KEY UPDATE) au lieu d'ignorer les clés existantes
+UPSERT_TABLES = set()
+# Session de chargement massif : une connexion, contrôles FK/unicité coupés, gros commits
+BULK_SESSION = False
+# Rechargement complet dans <table>__next puis bascule atomique (RENAME TABLE)
+SHADOW_LOAD = False
+SHADOW_SUFFIX = '__next'
+# Nombre de tables chargées simultanément (une connexion du pool chacune)
+LOAD_WORKERS = 4
 os.makedirs(EXPORT_DIR, exist_ok=True)
 
+# Débit (lignes/s) observé avec index par table, pour estimer le gain du mode sans index
+_indexed_load_rates = {}
+
+# Changelog SQLite consommé : dernier seq lu par table (purgé après un chargement réussi) et clés supprimées
+_pending_changelog = {}
+_changelog_deletions = {}
+
 # === LOGGING ===
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
+# === DÉFINITION DES TABLES MYSQL ===
+# Dans l'ordre des clés étrangères ; le graphe de dépendances est lu dans les clauses REFERENCES
+TABLE_DEFINITIONS = {
+    'Regions': """
+    CREATE TABLE IF NOT EXISTS Regions (
+        region_id INT PRIMARY KEY,
+        nom_region VARCHAR(255)
+    )""",
+    'Revendeurs': """
+    CREATE TABLE IF NOT EXISTS Revendeurs (
+        revendeur_id INT PRIMARY KEY,
+        nom_revendeur VARCHAR(255),
+        region_id INT,
+        email_contact VARCHAR(255),
+        FOREIGN KEY (region_id) REFERENCES Regions(region_id)
+    )""",
+    'Produits': """
+    CREATE TABLE IF NOT EXISTS Produits (
+        produit_id INT PRIMARY KEY,
+        nom_produit VARCHAR(255),
+        prix_unitaire FLOAT
+    )""",
+    'Productions': """
+    CREATE TABLE IF NOT EXISTS Productions (
+        production_id INT PRIMARY KEY,
+        product_id INT,
+        quantite_produite INT,
+        date DATE
+    )""",
+    'ProductionsJournalieres': """
+    CREATE TABLE IF NOT EXISTS ProductionsJournalieres (
+        product_id INT,
+        date DATE,
+        quantite_produite INT,
+        nb_productions INT,
+        PRIMARY KEY (product_id, date)
+    )""",
+    'Commandes': """
+    CREATE TABLE IF NOT EXISTS Commandes (
+        commande_id INT PRIMARY KEY,
+        numero_commande VARCHAR(255),
+        date_commande DATETIME,
+        revendeur_id INT,
+        FOREIGN KEY (revendeur_id) REFERENCES Revendeurs(revendeur_id)
+    )""",
+    'LignesCommande': """
+    CREATE TABLE IF NOT EXISTS LignesCommande (
+        ligne_id INT PRIMARY KEY,
+        commande_id INT,
+        produit_id INT,
+        quantite INT,
+        prix_unitaire_vente FLOAT,
+        FOREIGN KEY (commande_id) REFERENCES Commandes(commande_id),
+        FOREIGN KEY (produit_id) REFERENCES Produits(produit_id)
+    )""",
+}
+
 # === FONCTION : Créer l'utilisateur MySQL avec droits ===
 def creer_utilisateur_mysql():
     """Crée l'utilisateur 'appuser'@'localhost' et lui attribue les droits nécessaires"""
@@ -53,7 +175,8 @@ def creer_utilisateur_mysql():
 
             # Attribuer les droits nécessaires
             privileges = (
-                "SELECT, INSERT, UPDATE, DELETE, LOCK TABLES, "
+                "SELECT, INSERT, UPDATE, DELETE, CREATE, DROP, ALTER, INDEX, REFERENCES, "
+                "CREATE TEMPORARY TABLES, LOCK TABLES, "
                 "SHOW VIEW, EVENT, TRIGGER"
             )
             cursor.execute(f"GRANT {privileges} ON {MYSQL_DB}.* TO 'appuser'@'localhost';")
@@ -65,63 +188,500 @@ def creer_utilisateur_mysql():
         raise
 
 
-# === FONCTION : Créer les tables si elles n'existent pas ===
-def create_table_if_not_exists(engine, create_table_sql):
-    with engine.connect() as connection:
-        try:
-            connection.execute(text(create_table_sql))
-            connection.commit()
-            logging.info("✅ Table créée ou existe déjà")
-        except Exception as e:
-            logging.error(f"❌ Erreur lors de la création de la table : {e}")
-            raise
+# === FONCTION : Découper le CSV en plages d'octets ===
+def csv_byte_ranges(path, start, end, parts):
+    """Découpe [start, end) en `parts` plages alignées sur les fins de ligne.
+
+    Suppose qu'aucun champ ne contient de saut de ligne (pas de champ
+    multi-lignes entre guillemets dans les fichiers de commandes).
+    """
+    bounds = [start]
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for i in range(1, parts):
+            newline = mm.find(b'\n', max(start + (end - start) * i // parts, bounds[-1]), end)
+            if newline < 0 or newline + 1 >= end:
+                break
+            bounds.append(newline + 1)
+    bounds.append(end)
+    return list(zip(bounds, bounds[1:]))
+
+
+# === FONCTION : Compter les lignes avant un octet ===
+def count_lines(path, offset):
+    """Nombre de sauts de ligne avant `offset` (numéros de ligne absolus des erreurs)"""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return sum(mm[pos:min(pos + (1 << 24), offset)].count(b'\n') for pos in range(0, offset, 1 << 24))
+
+
+# === FONCTION : Première ligne hors schéma ===
+def first_invalid_row(raw):
+    """Position de la première ligne dont une colonne entière ou date renseignée ne se convertit pas (None si aucune)"""
+    bad = pd.Series(False, index=raw.index)
+    for col, dtype in CSV_DTYPES.items():
+        if col in raw.columns and pd.api.types.is_integer_dtype(dtype):
+            bad |= raw[col].notna() & pd.to_numeric(raw[col], errors='coerce').isna()
+    for col, fmt in CSV_DATE_FORMATS.items():
+        if col in raw.columns:
+            bad |= raw[col].notna() & pd.to_datetime(raw[col], format=fmt, errors='coerce').isna()
+    return int(bad.to_numpy().argmax()) if bad.any() else None
+
+
+# === FONCTION : Analyser une plage d'octets (processus de travail) ===
+def parse_csv_range(path, header, start, end):
+    """Analyse les octets [start, end) du CSV projeté en mémoire.
+
+    Retourne (frame, lignes de la plage, erreur) ; l'erreur est None ou
+    (rang de la ligne fautive dans la plage, message).
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = mm[start:end]
+    n_lines = data.count(b'\n')
+    try:
+        df = parse_csv_dates(pd.read_csv(io.BytesIO(header + data), dtype=CSV_DTYPES))
+    except pd.errors.ParserError as e:
+        # "Expected 7 fields in line 12, saw 8" : la ligne 1 est l'en-tête
+        match = re.search(r' in line (\d+)', str(e))
+        message = re.sub(r' in line \d+', '', str(e)).strip()
+        return None, n_lines, (int(match.group(1)) - 2 if match else None, message)
+    except ValueError as e:
+        # Conversion de type ou de date : la ligne n'est pas donnée, on la retrouve sur une lecture brute
+        raw = pd.read_csv(io.BytesIO(header + data), dtype=str)
+        # Première ligne du message : pandas y ajoute des suggestions de format sur plusieurs lignes
+        return None, n_lines, (first_invalid_row(raw), str(e).splitlines()[0])
+    return df, n_lines, None
+
+
+# === FONCTION : Analyse parallèle d'un gros CSV ===
+def parse_csv_parallel(path, header, start, end, max_workers=CSV_WORKERS):
+    """Analyse les octets [start, end) du CSV en plages parallèles (processus de travail, mmap).
+
+    Les frames sont recombinées dans l'ordre du fichier. Les erreurs
+    d'analyse de toutes les plages sont journalisées avec leur numéro de
+    ligne absolu dans le fichier, puis levées ensemble (ParserError).
+    """
+    ranges = csv_byte_ranges(path, start, end, max_workers)
+    logging.info(f"⚡ Analyse parallèle : {end - start} octets en {len(ranges)} plages")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=CSV_MP_CONTEXT) as pool:
+        results = list(pool.map(parse_csv_range, repeat(path), repeat(header),
+                                [a for a, _ in ranges], [b for _, b in ranges]))
+
+    errors = []
+    for (range_start, _), (_, _, error) in zip(ranges, results):
+        if error:
+            row, message = error
+            if row is None:
+                errors.append(f"plage à partir de l'octet {range_start} : {message}")
+            else:
+                # Ligne 1 = en-tête ; les numéros sont ceux du fichier entier
+                line = count_lines(path, range_start) + row + 1
+                errors.append(f"ligne {line} : {message}")
+    if errors:
+        for error in errors:
+            logging.error(f"❌ {path}, {error}")
+        raise pd.errors.ParserError(f"{len(errors)} erreur(s) d'analyse dans {path} : " + ' ; '.join(errors))
+
+    df = pd.concat([df for df, _, _ in results], ignore_index=True)
+    # Catégories différentes d'une plage à l'autre : le type est rétabli après concaténation
+    categories = [col for col, dtype in CSV_DTYPES.items() if dtype == 'category' and col in df.columns]
+    return df.astype({col: 'category' for col in categories})
 
 
 # === FONCTION : Extraire CSV ===
-def extract_csv(path):
-    logging.info("📥 Extraction du fichier CSV...")
+def extract_csv(path, incremental=CSV_CHECKPOINT, workers=CSV_WORKERS):
+    """Lit le CSV (seulement les lignes ajoutées depuis le dernier point de reprise si `incremental`).
+
+    Au-delà de CSV_PARALLEL_MIN_BYTES à lire, l'analyse est répartie sur
+    `workers` processus (plages d'octets, voir parse_csv_parallel).
+    """
+    logging.info(f"📥 Extraction du fichier CSV (moteur {CSV_ENGINE})...")
     if not os.path.exists(path):
         raise FileNotFoundError(f"❌ Fichier CSV introuvable : {path}")
-    df = pd.read_csv(path)
+    header, start, end = csv_tail_range(path, incremental)
+    checkpoint = _pending_csv_checkpoints[os.path.abspath(path)]
+    key = csv_staging_key(path, header, start, end)
+    df, staged_checkpoint = read_staged(key)
+    if df is not None:
+        # Position atteinte dans une source compressée : enregistrée avec la frame
+        checkpoint.update(staged_checkpoint or {})
+    else:
+        # Les sources compressées (end=None) ne se découpent pas en plages d'octets
+        if end is not None and workers > 1 and end - start >= CSV_PARALLEL_MIN_BYTES:
+            df = parse_csv_parallel(path, header, start, end, workers)
+        else:
+            with open_csv_range(path, header, start, end) as stream:
+                df = parse_csv_dates(pd.read_csv(stream, engine=CSV_ENGINE, dtype=CSV_DTYPES))
+        write_staged(key, df, {k: v for k, v in checkpoint.items() if k != 'line_counts'})
     logging.info(f"✅ {len(df)} lignes extraites du CSV")
     return df
 
 
+# === FONCTION : Extraire CSV par blocs ===
+def extract_csv_chunks(path, chunksize, incremental=CSV_CHECKPOINT):
+    """Lit le CSV par blocs de `chunksize` lignes (générateur) pour borner la mémoire"""
+    logging.info(f"📥 Extraction du fichier CSV par blocs de {chunksize} lignes...")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"❌ Fichier CSV introuvable : {path}")
+    total = 0
+    # Le moteur pyarrow ne sait pas lire par blocs : moteur C, même schéma
+    with open_csv_tail(path, incremental) as stream, pd.read_csv(stream, chunksize=chunksize, dtype=CSV_DTYPES) as reader:
+        for chunk in reader:
+            total += len(chunk)
+            yield parse_csv_dates(chunk)
+    logging.info(f"✅ {total} lignes extraites du CSV")
+
+
+# === FONCTION : Installer la capture des changements SQLite ===
+def install_sqlite_cdc(db_path, tables=SQLITE_CDC_TABLES):
+    """Crée _etl_changelog et les triggers AFTER INSERT/UPDATE/DELETE de `tables` (idempotent).
+
+    Chaque changement y laisse (seq, table, clé, opération). À l'installation
+    des triggers d'une table, toutes ses clés sont journalisées : la première
+    consommation resynchronise la table entière.
+    """
+    with closing(sqlite3.connect(db_path)) as conn, conn:
+        conn.execute("""CREATE TABLE IF NOT EXISTS _etl_changelog (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tbl TEXT NOT NULL,
+            pk INTEGER NOT NULL,
+            op TEXT NOT NULL
+        )""")
+        for table in tables:
+            pk = SQLITE_TABLES[table]
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                            (f"_etl_{table}_ai",)).fetchone():
+                continue
+            log = "INSERT INTO _etl_changelog (tbl, pk, op)"
+            conn.execute(f"CREATE TRIGGER _etl_{table}_ai AFTER INSERT ON {table} "
+                         f"BEGIN {log} VALUES ('{table}', NEW.{pk}, 'I'); END")
+            # Une clé modifiée est journalisée comme suppression de l'ancienne clé
+            conn.execute(f"CREATE TRIGGER _etl_{table}_au AFTER UPDATE ON {table} "
+                         f"BEGIN {log} VALUES ('{table}', NEW.{pk}, 'U'); "
+                         f"{log} SELECT '{table}', OLD.{pk}, 'D' WHERE OLD.{pk} <> NEW.{pk}; END")
+            conn.execute(f"CREATE TRIGGER _etl_{table}_ad AFTER DELETE ON {table} "
+                         f"BEGIN {log} VALUES ('{table}', OLD.{pk}, 'D'); END")
+            conn.execute(f"{log} SELECT '{table}', {pk}, 'I' FROM {table}")
+            logging.info(f"🪝 Capture des changements installée sur '{table}'")
+
+
+# === FONCTION : Consommer le changelog SQLite ===
+def changelog_position(conn, table):
+    """Dernier seq journalisé pour `table` (0 si aucun)"""
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM _etl_changelog WHERE tbl = ?", (table,)).fetchone()[0]
+
+
+def extract_changelog(conn, table):
+    """Lignes actuelles des clés journalisées pour `table` ; les clés disparues vont dans _changelog_deletions.
+
+    L'effet net se lit sur l'état courant de la table : une clé journalisée
+    encore présente est à insérer ou mettre à jour, absente à supprimer. Les
+    changements postérieurs au seq lu seront repris au run suivant.
+    """
+    pk = SQLITE_TABLES[table]
+    last_seq = changelog_position(conn, table)
+    keys = pd.read_sql("SELECT DISTINCT pk FROM _etl_changelog WHERE tbl = ? AND seq <= ?",
+                       conn, params=(table, last_seq))['pk']
+    df = pd.read_sql(f"SELECT * FROM {table} WHERE {pk} IN (SELECT value FROM json_each(?))",
+                     conn, params=(json.dumps(keys.tolist()),))
+    _changelog_deletions[table] = pd.Index(keys[~keys.isin(df[pk])])
+    _pending_changelog[table] = last_seq
+    logging.info(f"✅ Table '{table}' (changelog) : {len(df)} lignes modifiées, "
+                 f"{len(_changelog_deletions[table])} supprimées")
+    return df
+
+
+def trim_changelog(db_path):
+    """Purge du journal les changements consommés, une fois le chargement réussi"""
+    if not _pending_changelog:
+        return
+    with closing(sqlite3.connect(db_path)) as conn, conn:
+        for table, last_seq in _pending_changelog.items():
+            conn.execute("DELETE FROM _etl_changelog WHERE tbl = ? AND seq <= ?", (table, last_seq))
+    logging.info(f"🧹 Changelog SQLite purgé : {', '.join(_pending_changelog)}")
+    _pending_changelog.clear()
+
+
+# === FONCTION : Extraire une table SQLite ===
+def extract_table(db_path, table, incremental=True, db_digest=None):
+    """Lit une table sur sa propre connexion (extraction concurrente des tables).
+
+    Avec `db_digest` (empreinte de la base), la table complète est servie
+    par le cache de staging si la base n'a pas changé. La pagination par clé
+    borne chaque requête, pas la frame : une lecture complète assemble toute
+    la table en mémoire (celle de la production passe par
+    load_production_pages() avec PRODUCTION_PAGED).
+    """
+    if incremental and table in INCREMENTAL_TABLES:
+        with closing(sqlite_readonly(db_path)) as conn:
+            return extract_incremental(conn, table, INCREMENTAL_TABLES[table])
+    if SQLITE_CDC and table in SQLITE_CDC_TABLES:
+        with closing(sqlite_readonly(db_path)) as conn:
+            if incremental:
+                return extract_changelog(conn, table)
+            # Relecture complète : elle couvre tout ce qui est déjà journalisé
+            _pending_changelog[table] = changelog_position(conn, table)
+    key = staging_key('sqlite', db_digest, table) if db_digest else None
+    df, _ = read_staged(key)
+    if df is None:
+        with closing(sqlite_readonly(db_path)) as conn:
+            df = concat_pages(conn, table, iter_keyset_pages(conn, table, SQLITE_TABLES[table]))
+        write_staged(key, df)
+    logging.info(f"✅ Table '{table}' : {len(df)} lignes")
+    return df
+
+
 # === FONCTION : Extraire SQLite ===
-def extract_sqlite(db_path):
+def extract_sqlite(db_path, incremental=True, skip=()):
+    """Tables SQLITE_TABLES de la base (hors `skip`) ; celles d'INCREMENTAL_TABLES limitées aux nouvelles lignes si `incremental`"""
     logging.info(f"🗄️  Connexion à la base SQLite : {db_path}")
     if not os.path.exists(db_path):
         raise FileNotFoundError(f"❌ Base SQLite introuvable : {db_path}")
 
-    with sqlite3.connect(db_path) as conn:
-        tables = pd.read_sql("SELECT name FROM sqlite_master WHERE type='table';", conn)
-        data = {}
-        for table in tables['name']:
-            df = pd.read_sql(f"SELECT * FROM {table}", conn)
-            data[table] = df
-            logging.info(f"✅ Table '{table}' : {len(df)} lignes")
-    return data
+    with closing(sqlite_readonly(db_path)) as conn:
+        existing = pd.read_sql("SELECT name FROM sqlite_master WHERE type='table';", conn)['name']
+    tables = [table for table in SQLITE_TABLES if table in set(existing) and table not in skip]
+    # Lectures indépendantes : chaque table sur sa connexion, en parallèle
+    db_digest = sqlite_digest(db_path) if STAGING_ENABLED else None
+    with ThreadPoolExecutor(max_workers=EXTRACT_WORKERS) as pool:
+        futures = {table: pool.submit(extract_table, db_path, table, incremental, db_digest)
+                   for table in tables}
+    return {table: future.result() for table, future in futures.items()}
 
 
-# === FONCTION : Charger avec anti-doublons ===
-def load_to_mysql_deduplicated(df, table_name, engine, pk_column, index_as_pk=False):
-    logging.info(f"🔁 Chargement dans MySQL (anti-doublons) : '{table_name}'")
+# === FONCTION : Lecture de la production page par page ? ===
+def production_paged(db_path, incremental=True):
+    """Vrai si la production présente dans SQLite serait relue entièrement : elle est alors chargée page par page"""
+    if not PRODUCTION_PAGED or PRODUCTION_PUSHDOWN:
+        return False
+    with closing(sqlite_readonly(db_path)) as conn:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'production'").fetchone():
+            return False
+        if not incremental or 'production' not in INCREMENTAL_TABLES:
+            return True
+        return incremental_after(conn, 'production', INCREMENTAL_TABLES['production']) is None
+
+
+# === FONCTION : Préparer la production ===
+def prepare_productions(df):
+    """Colonnes de la table Productions à partir de la table SQLite production"""
+    df = df.rename(columns={
+        'quantity': 'quantite_produite',
+        'date_production': 'date',
+        'product_id': 'product_id'
+    })
+    return df.reset_index()
+
+
+# === FONCTION : Charger la production page par page ===
+def load_production_pages(db_path, engine, suffix='', changes=None, watermark=False):
+    """Lecture complète de la production chargée page par page (iter_table_pages) : une page en mémoire à la fois.
+
+    Avec `changes` (CDC), chaque page est comparée aux empreintes du dernier
+    chargement ; les clés précédentes absentes de toutes les pages sont les
+    suppressions, rangées dans changes['Productions'] avec les empreintes
+    courantes. Avec `watermark`, le high-water mark de la dernière ligne est
+    mis en attente comme par extract_incremental().
+    """
+    column = SQLITE_TABLES['production']
+    previous = load_fingerprints('Productions') if changes is not None else None
+    fingerprints = []
+    rows, last = 0, None
+    for page in iter_table_pages(db_path, 'production', column):
+        # Index continu d'une page à l'autre : même colonne 'index' qu'une lecture en une frame
+        page.index += rows
+        rows += len(page)
+        last = page[column].iloc[-1].item()
+        df = prepare_productions(page)
+        if changes is None:
+            load_to_mysql_deduplicated(df, 'Productions' + suffix, engine, pk_column='production_id')
+            continue
+        page_changes = diff_fingerprints(df, previous, 'production_id')
+        fingerprints.append(page_changes['fingerprints'])
+        load_changes(page_changes, 'Productions' + suffix, engine)
+    if changes is not None:
+        current = pd.concat(fingerprints) if fingerprints else pd.Series([], dtype='uint64')
+        deleted = previous.index[~previous.index.isin(current.index)] if previous is not None else pd.Index([])
+        changes['Productions'] = {'pk_column': 'production_id', 'deleted': deleted, 'fingerprints': current}
+    if watermark and last is not None:
+        with closing(sqlite_readonly(db_path)) as conn:
+            pend_watermark(conn, 'production', column, last)
+    logging.info(f"✅ Table 'production' : {rows} lignes chargées page par page")
+
+
+# === FONCTION : Totaux de production agrégés dans SQLite ===
+def extract_production_totals(db_path):
+    """SUM(quantity) par (product_id, date_production), calculé dans SQLite.
+
+    L'index couvrant (product_id, date_production, quantity) est créé au
+    besoin : le GROUP BY parcourt l'index dans l'ordre, sans tri ni accès à
+    la table, et seules les lignes agrégées sortent de SQLite.
+    """
+    # Seule écriture dans la source : l'index de support, sur une connexion dédiée
+    with closing(sqlite3.connect(db_path)) as conn:
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_production_produit_date "
+                     "ON production (product_id, date_production, quantity)")
+    with closing(sqlite_readonly(db_path)) as conn:
+        totals = pd.read_sql("""
+            SELECT product_id, date_production AS date,
+                   SUM(quantity) AS quantite_produite, COUNT(*) AS nb_productions
+            FROM production
+            GROUP BY product_id, date_production
+        """, conn)
+    totals['date'] = pd.to_datetime(totals['date'])
+    logging.info(f"✅ Production agrégée dans SQLite : {totals['nb_productions'].sum()} lignes -> {len(totals)} totaux")
+    return totals
+
+
+# === FONCTION : Charger les totaux de production ===
+def load_production_totals(totals, engine, table_name='ProductionsJournalieres'):
+    """Remplace les totaux journaliers en une transaction (ils sont recalculés entièrement à chaque run)"""
+    with connect(engine) as conn:
+        conn.execute(text(f"DELETE FROM {table_name}"))
+        totals.to_sql(table_name, con=conn, if_exists='append', index=False,
+                      method='multi', chunksize=BATCH_INITIAL_ROWS)
+        commit(conn, len(totals))
+    logging.info(f"✅ {len(totals)} totaux de production chargés dans '{table_name}'")
+
+
+# === FONCTION : Clés étrangères déclarées ===
+def foreign_keys(table_definitions=TABLE_DEFINITIONS):
+    """Retourne [(table, colonne, table référencée, colonne référencée)] d'après les DDL"""
+    pattern = r"FOREIGN KEY\s*\(`?(\w+)`?\)\s*REFERENCES\s+`?(\w+)`?\s*\(`?(\w+)`?\)"
+    return [
+        (table, column, parent, parent_column)
+        for table, ddl in table_definitions.items()
+        for column, parent, parent_column in re.findall(pattern, ddl, re.IGNORECASE)
+    ]
+
+
+# === FONCTION : Contrôle d'intégrité après chargement ===
+def check_foreign_keys(conn, tables, suffix=''):
+    """Compte les lignes orphelines de `tables` (une requête par FK) et lève une erreur s'il y en a.
+
+    `suffix` désigne les tables réellement écrites (ex. '__next' en chargement fantôme).
+    """
+    orphans = {}
+    for table, column, parent, parent_column in foreign_keys():
+        if table not in tables:
+            continue
+        parent_table = parent + suffix if parent in tables else parent
+        count = conn.execute(text(
+            f"SELECT COUNT(*) FROM `{table}{suffix}` c "
+            f"LEFT JOIN `{parent_table}` p ON p.`{parent_column}` = c.`{column}` "
+            f"WHERE c.`{column}` IS NOT NULL AND p.`{parent_column}` IS NULL"
+        )).scalar()
+        if count:
+            orphans[f"{table}.{column} -> {parent}"] = count
+    if orphans:
+        raise ValueError(f"❌ Lignes orphelines après chargement : {orphans}")
+    logging.info(f"✅ Intégrité référentielle vérifiée pour {len(tables)} tables")
+
+
+# === FONCTION : Session de chargement massif ===
+@contextmanager
+def bulk_load_session(engine, tables, suffix=''):
+    """Épingle une connexion pour tout le chargement et y coupe les contrôles ligne à ligne.
+
+    foreign_key_checks, unique_checks et autocommit sont désactivés sur la
+    connexion qui écrit réellement (et non sur une autre connexion du pool),
+    les écritures sont validées par transactions de BULK_COMMIT_ROWS lignes,
+    les réglages d'origine sont restaurés en sortie et l'intégrité des
+    `tables` est contrôlée en une passe après le chargement.
+    """
     with engine.connect() as conn:
-        # Vérifier si la table existe
+        saved = conn.execute(text(
+            "SELECT @@SESSION.foreign_key_checks, @@SESSION.unique_checks, @@SESSION.autocommit"
+        )).one()
+        conn.execute(text("SET SESSION foreign_key_checks = 0, unique_checks = 0, autocommit = 0"))
+        conn.info['bulk_session'] = {'pending': 0}
+        logging.info("⚡ Session de chargement massif ouverte (contrôles FK/unicité suspendus)")
         try:
-            conn.execute(text(f"SELECT 1 FROM `{table_name}` LIMIT 1"))
-            has_table = True
+            yield conn
+            conn.commit()
         except Exception:
-            has_table = False
-
-        if has_table and pk_column:
+            conn.rollback()
+            raise
+        finally:
+            conn.info.pop('bulk_session', None)
             try:
-                existing = pd.read_sql(f"SELECT `{pk_column}` FROM `{table_name}`", conn)
-                existing_ids = existing[pk_column].dropna().tolist()
-                df = df[~df[pk_column].isin(existing_ids)]
-                logging.info(f"➡️  {len(df)} nouvelles lignes après filtrage des doublons")
+                conn.execute(
+                    text("SET SESSION foreign_key_checks = :fk, unique_checks = :uc, autocommit = :ac"),
+                    {'fk': saved[0], 'uc': saved[1], 'ac': saved[2]}
+                )
+                conn.commit()
             except Exception as e:
-                logging.warning(f"⚠️  Impossible de lire les IDs existants dans '{table_name}' : {e}")
+                # Ne jamais rendre au pool une connexion sans contrôle des FK
+                logging.error(f"❌ Restauration des réglages de session impossible : {e}")
+                conn.invalidate()
+                raise
+        check_foreign_keys(conn, tables, suffix)
+
+
+# === FONCTION : Index secondaires retirés pendant un gros chargement ===
+@contextmanager
+def secondary_indexes_dropped(conn, table_name):
+    """Retire les index secondaires non uniques (et les seules FK qui s'appuient dessus) le temps du bloc.
+
+    Les définitions sont relues dans SHOW CREATE TABLE puis reconstruites en un
+    seul ALTER TABLE ... ADD INDEX / ADD CONSTRAINT, y compris si le bloc
+    échoue ; les clés étrangères sont ensuite contrôlées en une passe
+    (check_foreign_keys) plutôt que ligne à ligne pendant l'ALTER.
+    foreign_key_checks retrouve sa valeur d'entrée. Les ALTER TABLE valident
+    implicitement la transaction en cours : ne pas l'utiliser dans une session
+    de chargement massif (use_bulk_index l'écarte).
+    Donne un dictionnaire où est reporté le temps de reconstruction.
+    """
+    ddl = conn.execute(text(f"SHOW CREATE TABLE `{table_name}`")).one()[1]
+    keys = re.findall(r"^\s*(KEY `([^`]+)` \((.*)\).*?),?$", ddl, re.MULTILINE)
+    timings = {'rebuild': 0.0}
+    if not keys:
+        yield timings
+        return
+    # Une FK a besoin d'un index commençant par ses colonnes : seules celles que portent
+    # uniquement les index retirés (ni la clé primaire ni un index unique) sont retirées
+    kept = re.findall(r"^\s*(?:PRIMARY|UNIQUE) KEY .*?\((.*)\)", ddl, re.MULTILINE)
+    fks = [
+        (definition, name)
+        for definition, name, columns in re.findall(
+            r"^\s*(CONSTRAINT `([^`]+)` FOREIGN KEY \(([^)]*)\).*?),?$", ddl, re.MULTILINE)
+        if any(index_covers(key_columns, columns) for _, _, key_columns in keys)
+        and not any(index_covers(index, columns) for index in kept)
+    ]
+    saved_checks = conn.execute(text("SELECT @@SESSION.foreign_key_checks")).scalar()
+
+    if fks:
+        conn.execute(text(f"ALTER TABLE `{table_name}` " + ", ".join(f"DROP FOREIGN KEY `{name}`" for _, name in fks)))
+    conn.execute(text(f"ALTER TABLE `{table_name}` " + ", ".join(f"DROP INDEX `{name}`" for _, name, _ in keys)))
+    logging.info(f"🗂️  '{table_name}' : {len(keys)} index secondaires et {len(fks)} FK retirés pour le chargement")
+    try:
+        yield timings
+    finally:
+        started = time.perf_counter()
+        # FK contrôlées en une passe après l'ALTER : pas de revalidation ligne à ligne
+        conn.execute(text("SET SESSION foreign_key_checks = 0"))
+        try:
+            conn.execute(text(f"ALTER TABLE `{table_name}` " + ", ".join(
+                [f"ADD {definition}" for definition, _, _ in keys] + [f"ADD {definition}" for definition, _ in fks]
+            )))
+        finally:
+            conn.execute(text("SET SESSION foreign_key_checks = :checks"), {'checks': saved_checks})
+        timings['rebuild'] = time.perf_counter() - started
+        logging.info(f"🗂️  '{table_name}' : index reconstruits en {timings['rebuild']:.1f}s")
+    # Atteint seulement si le bloc a réussi ; une erreur du bloc est relancée après la reconstruction
+    base_table = table_name.removesuffix(SHADOW_SUFFIX)
+    check_foreign_keys(conn, {base_table}, table_name[len(base_table):])
+
+
+# === FONCTION : Charger avec anti-doublons ===
+def load_to_mysql_deduplicated(df, table_name, engine, pk_column, index_as_pk=False, bulk=None, upsert=None):
+    base_table = table_name.removesuffix(SHADOW_SUFFIX)
+    if bulk is None:
+        bulk = base_table in BULK_LOAD_TABLES
+    if upsert is None:
+        upsert = base_table in UPSERT_TABLES
+    logging.info(f"🔁 Chargement dans MySQL (anti-doublons{', LOAD DATA' if bulk else ''}) : '{table_name}'")
+    if df.empty:
+        logging.info(f"🟡 Aucune nouvelle ligne à insérer dans '{table_name}'")
+        return
 
     # Définir les types SQL
     dtype_mapping = {}
@@ -135,21 +695,401 @@ def load_to_mysql_deduplicated(df, table_name, engine, pk_column, index_as_pk=Fa
         elif df[col].dtype == 'datetime64[ns]':
             dtype_mapping[col] = types.DateTime()
 
-    if not df.empty:
+    with connect(engine) as conn:
+        # Vérifier si la table existe
         try:
-            df.to_sql(
-                table_name,
-                con=engine,
-                if_exists='append',
-                index=index_as_pk,
-                dtype=dtype_mapping
-            )
-            logging.info(f"✅ {len(df)} lignes insérées dans '{table_name}'")
-        except Exception as e:
-            logging.error(f"❌ Échec du chargement dans '{table_name}' : {e}")
-            raise
-    else:
-        logging.info(f"🟡 Aucune nouvelle ligne à insérer dans '{table_name}'")
+            conn.execute(text(f"SELECT 1 FROM `{table_name}` LIMIT 1"))
+            has_table = True
+        except Exception:
+            has_table = False
+
+        if has_table and pk_column and upsert:
+            # Les clés existantes sont mises à jour avec les valeurs corrigées
+            try:
+                affected = upsert_rows(conn, df, table_name, pk_column, index_as_pk=index_as_pk)
+                commit(conn, len(df))
+            except Exception as e:
+                logging.error(f"❌ Échec de l'upsert dans '{table_name}' : {e}")
+                raise
+            logging.info(f"✅ Upsert de {len(df)} lignes dans '{table_name}' ({affected} lignes affectées)")
+            return
+
+        if has_table and pk_column:
+            bulk_index = use_bulk_index(conn, table_name, len(df))
+            index_context = secondary_indexes_dropped(conn, table_name) if bulk_index else nullcontext({})
+            started = time.perf_counter()
+            # Filtrage des doublons dans MySQL (table temporaire + anti-jointure)
+            try:
+                with index_context as timings:
+                    inserted = insert_missing_keys(conn, df, table_name, pk_column, dtype_mapping, index_as_pk, bulk)
+                    commit(conn, inserted)
+            except Exception as e:
+                logging.error(f"❌ Échec du chargement dans '{table_name}' : {e}")
+                raise
+            elapsed = time.perf_counter() - started
+            if not bulk_index:
+                _indexed_load_rates[base_table] = len(df) / max(elapsed, 1e-6)
+            elif base_table in _indexed_load_rates:
+                estimated = len(df) / _indexed_load_rates[base_table]
+                logging.info(f"⏱️  '{table_name}' : {elapsed:.1f}s sans index (dont {timings['rebuild']:.1f}s de reconstruction), "
+                             f"~{estimated - elapsed:.1f}s gagnées par rapport au débit avec index")
+            else:
+                logging.info(f"⏱️  '{table_name}' : {elapsed:.1f}s sans index (dont {timings['rebuild']:.1f}s de reconstruction)")
+            if inserted:
+                logging.info(f"✅ {inserted} lignes insérées dans '{table_name}' ({len(df) - inserted} doublons ignorés)")
+            else:
+                logging.info(f"🟡 Aucune nouvelle ligne à insérer dans '{table_name}'")
+            return
+
+    try:
+        with connect(engine) as conn:
+            to_sql_batched(df, table_name, conn, index_as_pk, dtype_mapping)
+        logging.info(f"✅ {len(df)} lignes insérées dans '{table_name}'")
+    except Exception as e:
+        logging.error(f"❌ Échec du chargement dans '{table_name}' : {e}")
+        raise
+
+
+# === FONCTION : Clés naturelles des commandes ===
+def commandes_natural_keys(df_csv, line_counts=None):
+    """Renomme les colonnes du CSV et ajoute les clés naturelles `commande_key` et `ligne_key`.
+
+    La clé de commande est (numero_commande, date_commande, revendeur_id),
+    celle de ligne (commande, produit, rang de la ligne dans la commande). En
+    lecture par blocs, `line_counts` (dernière clé de commande -> lignes déjà
+    vues, voir update_line_counts) est partagé entre les blocs pour prolonger
+    le rang d'une commande à cheval.
+    N'accède pas au registre : peut tourner dans un processus de travail.
+    """
+    df_csv = df_csv.rename(columns={
+        'numero_commande': 'numero_commande',
+        'commande_date': 'date_commande',
+        'quantity': 'quantite',
+        'unit_price': 'prix_unitaire_vente'
+    })
+    commande_key = natural_key(df_csv, ['numero_commande', 'date_commande', 'revendeur_id'])
+
+    # Rang de la ligne dans sa commande, dans l'ordre du fichier
+    rang = commande_key.groupby(commande_key, sort=False).cumcount() + 1
+    if line_counts is not None:
+        rang += commande_key.map(line_counts).fillna(0).astype(int)
+        update_line_counts(line_counts, commande_key, rang)
+    ligne_key = natural_key(df_csv.assign(commande_key=commande_key, rang=rang), ['commande_key', 'product_id', 'rang'])
+    return df_csv.assign(commande_key=commande_key, ligne_key=ligne_key)
+
+
+# === FONCTION : Attribuer les ids des commandes ===
+def assign_commandes_ids(df_keys):
+    """Attribue commande_id / ligne_id depuis le registre de clés (frame issue de commandes_natural_keys).
+
+    Retourne (commandes, lignes).
+    """
+    commande_ids = assign_surrogate_keys('commande', df_keys['commande_key'])
+    df_keys = df_keys.assign(commande_id=commande_ids)
+
+    # date_commande est déjà typée par parse_csv_dates()
+    commandes = df_keys[['commande_id', 'numero_commande', 'date_commande', 'revendeur_id']].drop_duplicates()
+
+    lignes = df_keys[['commande_id', 'product_id', 'quantite', 'prix_unitaire_vente']].copy()
+    lignes.loc[:, 'ligne_id'] = assign_surrogate_keys('ligne', df_keys['ligne_key'])
+    lignes = lignes.rename(columns={'product_id': 'produit_id'})
+    return commandes, lignes
+
+
+# === FONCTION : Transformer les commandes ===
+def transform_commandes(df_csv, line_counts=None):
+    """Renomme les colonnes du CSV et attribue commande_id / ligne_id depuis le registre de clés.
+
+    commande_id et ligne_id sont permanents pour leurs clés naturelles (voir
+    commandes_natural_keys). Retourne (commandes, lignes).
+    """
+    return assign_commandes_ids(commandes_natural_keys(df_csv, line_counts))
+
+
+# === FONCTION : Extraire et transformer les commandes ===
+def extract_commandes(path, incremental=CSV_CHECKPOINT):
+    """Lit le CSV de commandes et attribue les ids : (commandes, lignes)"""
+    return transform_commandes(extract_csv(path, incremental), csv_line_counts(path))
+
+
+# === FONCTION : Lister les fichiers de commandes ===
+def csv_files(source):
+    """Fichiers CSV d'un répertoire ou d'un motif glob, triés (ordre d'attribution des clés stable)"""
+    pattern = os.path.join(source, '*.csv') if os.path.isdir(source) else source
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        raise FileNotFoundError(f"❌ Aucun fichier CSV pour : {source}")
+    return paths
+
+
+# === FONCTION : Préparer un fichier de commandes (processus de travail) ===
+def prepare_commandes_file(path, incremental=CSV_CHECKPOINT):
+    """Lit un fichier de commandes et calcule ses clés naturelles.
+
+    Retourne (frame préparée, point de reprise du fichier) : le point de
+    reprise est renvoyé au processus principal qui l'enregistre.
+    """
+    # Déjà dans un processus de travail : pas d'analyse parallèle imbriquée
+    df = commandes_natural_keys(extract_csv(path, incremental, workers=1), csv_line_counts(path))
+    return df, _pending_csv_checkpoints.get(os.path.abspath(path))
+
+
+# === FONCTION : Extraire plusieurs fichiers de commandes ===
+def extract_commandes_files(source, incremental=CSV_CHECKPOINT, max_workers=CSV_WORKERS):
+    """Lit et prépare les fichiers de `source` dans un pool de processus, puis attribue les ids.
+
+    Les fichiers sont analysés en parallèle ; les résultats sont concaténés
+    dans l'ordre trié des fichiers avant l'unique passage au registre, ce qui
+    rend l'attribution des clés déterministe. Le rang des lignes étant propre
+    à chaque fichier, une commande renvoyée dans un second fichier reprend les
+    mêmes clés de ligne : seule la première occurrence est gardée. Retourne
+    (commandes, lignes).
+    """
+    paths = csv_files(source)
+    logging.info(f"📂 {len(paths)} fichiers de commandes, {max_workers} processus")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=CSV_MP_CONTEXT) as pool:
+        results = list(pool.map(partial(prepare_commandes_file, incremental=incremental), paths))
+    for path, (_, checkpoint) in zip(paths, results):
+        if checkpoint:
+            _pending_csv_checkpoints[os.path.abspath(path)] = checkpoint
+    df_keys = pd.concat([df for df, _ in results], ignore_index=True)
+    duplicated = df_keys['ligne_key'].duplicated()
+    if duplicated.any():
+        logging.warning(f"⚠️  {int(duplicated.sum())} lignes de commande déjà présentes dans un fichier précédent : ignorées")
+        df_keys = df_keys[~duplicated]
+    logging.info(f"✅ {len(df_keys)} lignes extraites de {len(paths)} fichiers")
+    return assign_commandes_ids(df_keys)
+
+
+# === FONCTION : Charger les commandes en flux ===
+def load_commandes_streaming(path, engine, chunksize, table_suffix='', incremental=CSV_CHECKPOINT):
+    """Lit, transforme et charge le CSV bloc par bloc : la mémoire dépend de `chunksize`, pas du fichier"""
+    chunks = extract_csv_chunks(path, chunksize, incremental)
+    line_counts = None
+    rows = 0
+    for numero, chunk in enumerate(chunks, start=1):
+        if line_counts is None:
+            # Le point de reprise est ouvert avec le premier bloc
+            line_counts = csv_line_counts(path)
+        logging.info(f"🧩 Bloc {numero} : {len(chunk)} lignes")
+        commandes, lignes = transform_commandes(chunk, line_counts)
+        rows += len(lignes)
+        load_to_mysql_deduplicated(commandes, 'Commandes' + table_suffix, engine, pk_column='commande_id')
+        load_to_mysql_deduplicated(lignes, 'LignesCommande' + table_suffix, engine, pk_column='ligne_id')
+    logging.info(f"✅ {rows} lignes de commande traitées en flux")
+
+
+# === FONCTION : Empreintes des lignes ===
+def row_fingerprints(df, pk_column):
+    """Empreinte 64 bits de chaque ligne (colonnes hors clé), calculée en vectoriel et indexée par la clé"""
+    columns = [c for c in df.columns if c != pk_column]
+    hashes = pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+    return pd.Series(hashes, index=df[pk_column].to_numpy())
+
+
+# === FONCTION : Lire / écrire les empreintes ===
+def load_fingerprints(table_name):
+    """Empreintes du dernier chargement réussi de la table (None au premier passage)"""
+    path = os.path.join(CDC_STORE_DIR, f"{table_name}.npz")
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as store:
+        return pd.Series(store['hashes'], index=store['keys'])
+
+
+def save_fingerprints(table_name, fingerprints):
+    """Enregistre les empreintes (clés + hash, deux tableaux numpy) par remplacement atomique du fichier"""
+    os.makedirs(CDC_STORE_DIR, exist_ok=True)
+    path = os.path.join(CDC_STORE_DIR, f"{table_name}.npz")
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, keys=fingerprints.index.to_numpy(), hashes=fingerprints.to_numpy())
+    os.replace(tmp_path, path)
+
+
+# === FONCTION : Comparer aux empreintes précédentes ===
+def diff_fingerprints(df, previous, pk_column):
+    """Lignes 'inserted' et 'updated' de df par rapport aux empreintes `previous`, et 'fingerprints' de df.
+
+    Sans empreintes précédentes (None), toutes les lignes passent en 'updated'.
+    """
+    current = row_fingerprints(df, pk_column)
+    first_run = previous is None
+    if first_run:
+        previous = pd.Series([], dtype='uint64')
+    known = current.index.isin(previous.index) | first_run
+    changed = known & (previous.reindex(current.index).to_numpy() != current.to_numpy())
+    return {'pk_column': pk_column, 'inserted': df[~known], 'updated': df[changed], 'fingerprints': current}
+
+
+# === FONCTION : Capture des changements ===
+def detect_changes(df, table_name, pk_column):
+    """Compare df aux empreintes du dernier chargement.
+
+    Retourne un dict : 'inserted' et 'updated' (DataFrames), 'deleted'
+    (clés disparues de la source) et 'fingerprints' (état courant, à
+    enregistrer une fois le chargement réussi). Sans empreintes
+    précédentes, MySQL peut déjà contenir ces lignes dans un état plus
+    ancien : toutes passent en 'updated' (upsert) plutôt qu'en insertions
+    que l'anti-doublons ignorerait.
+    """
+    previous = load_fingerprints(table_name)
+    changes = diff_fingerprints(df, previous, pk_column)
+    changes['deleted'] = (previous.index[~previous.index.isin(changes['fingerprints'].index)]
+                          if previous is not None else pd.Index([]))
+    logging.info(f"🔎 CDC '{table_name}' : {len(changes['inserted'])} insertions, "
+                 f"{len(changes['updated'])} modifications, {len(changes['deleted'])} suppressions "
+                 f"sur {len(df)} lignes")
+    return changes
+
+
+# === FONCTION : Tâche de chargement d'une table ===
+def load_task(df, table_name, pk_column, suffix='', changes=None):
+    """Tâche pour load_tables_parallel ; avec `changes` (CDC), seules les lignes modifiées sont envoyées"""
+    if changes is None:
+        return partial(load_to_mysql_deduplicated, df, table_name + suffix, pk_column=pk_column)
+    changes[table_name] = detect_changes(df, table_name, pk_column)
+    return partial(load_changes, changes[table_name], table_name + suffix)
+
+
+# === FONCTION : Tâche d'une table de dimension ===
+def dimension_task(df, source, table_name, pk_column, suffix='', changes=None, log_changes=None):
+    """load_task(), sauf pour une table lue dans le changelog SQLite : upsert des lignes, suppression des clés disparues"""
+    if log_changes is None or source not in _changelog_deletions:
+        return load_task(df, table_name, pk_column, suffix, changes)
+    log_changes[table_name] = {'pk_column': pk_column, 'inserted': df.iloc[:0], 'updated': df,
+                               'deleted': _changelog_deletions[source]}
+    return partial(load_changes, log_changes[table_name], table_name + suffix)
+
+
+# === FONCTION : Charger les changements ===
+def load_changes(table_changes, table_name, engine):
+    """Insère les nouvelles lignes et met à jour (upsert) les lignes modifiées"""
+    pk_column = table_changes['pk_column']
+    load_to_mysql_deduplicated(table_changes['inserted'], table_name, engine, pk_column=pk_column)
+    load_to_mysql_deduplicated(table_changes['updated'], table_name, engine, pk_column=pk_column, upsert=True)
+
+
+# === FONCTION : Appliquer les suppressions ===
+def delete_removed_rows(engine, changes, batch_size=10_000):
+    """Supprime les clés disparues de la source, enfants d'abord (ordre inverse des FK)"""
+    with connect(engine) as conn:
+        for table_name in reversed(TABLE_DEFINITIONS):
+            if table_name not in changes or not len(changes[table_name]['deleted']):
+                continue
+            pk_column = changes[table_name]['pk_column']
+            keys = changes[table_name]['deleted'].tolist()
+            for start in range(0, len(keys), batch_size):
+                conn.execute(
+                    text(f"DELETE FROM `{table_name}` WHERE `{pk_column}` IN :keys").bindparams(
+                        bindparam('keys', expanding=True)),
+                    {'keys': keys[start:start + batch_size]}
+                )
+                commit(conn, batch_size)
+            logging.info(f"🗑️  {len(keys)} lignes supprimées de '{table_name}'")
+
+
+# === FONCTION : DDL d'une table fantôme ===
+def shadow_ddl(table, tables):
+    """DDL complet (index et FK compris) de `<table>__next`, les FK visant les tables fantômes de `tables`"""
+    ddl = re.sub(rf"CREATE TABLE IF NOT EXISTS\s+`?{table}`?", f"CREATE TABLE `{table}{SHADOW_SUFFIX}`",
+                 TABLE_DEFINITIONS[table])
+    return re.sub(
+        r"REFERENCES\s+`?(\w+)`?",
+        lambda m: f"REFERENCES `{m.group(1)}{SHADOW_SUFFIX if m.group(1) in tables else ''}`",
+        ddl
+    )
+
+
+# === FONCTION : Supprimer une liste de tables ===
+def drop_tables(engine, tables):
+    """DROP TABLE IF EXISTS, dans l'ordre donné (enfants d'abord)"""
+    with engine.connect() as conn:
+        for table in tables:
+            conn.execute(text(f"DROP TABLE IF EXISTS `{table}`"))
+        conn.commit()
+
+
+# === FONCTION : Chargement fantôme et bascule atomique ===
+@contextmanager
+def shadow_tables(engine, tables):
+    """Prépare `<table>__next` pour chaque table, laisse le bloc les remplir puis bascule tout d'un coup.
+
+    Les lecteurs (tableau de bord) continuent de lire les tables en place
+    pendant tout le chargement ; la bascule est un unique RENAME TABLE,
+    atomique pour l'ensemble des tables. En cas d'échec, seules les tables
+    fantômes sont supprimées. Donne le suffixe à utiliser pour les écritures.
+    """
+    ordered = [t for t in TABLE_DEFINITIONS if t in tables]
+    outside = sorted({f"{child} -> {parent}" for child, _, parent, _ in foreign_keys()
+                      if parent in tables and child not in tables})
+    if outside:
+        raise ValueError(f"❌ Tables dépendantes absentes du rechargement : {outside}")
+
+    # Restes d'une exécution précédente interrompue
+    drop_tables(engine, [t + suffix for suffix in (SHADOW_SUFFIX, '__old') for t in reversed(ordered)])
+    with engine.connect() as conn:
+        for table in ordered:
+            conn.execute(text(shadow_ddl(table, tables)))
+        conn.commit()
+    logging.info(f"👻 Tables fantômes créées : {', '.join(t + SHADOW_SUFFIX for t in ordered)}")
+
+    try:
+        yield SHADOW_SUFFIX
+    except Exception:
+        logging.error("❌ Chargement fantôme abandonné : les tables en place sont intactes")
+        drop_tables(engine, [t + SHADOW_SUFFIX for t in reversed(ordered)])
+        raise
+
+    renames = ", ".join(f"`{t}` TO `{t}__old`, `{t}{SHADOW_SUFFIX}` TO `{t}`" for t in ordered)
+    with engine.connect() as conn:
+        conn.execute(text(f"RENAME TABLE {renames}"))
+    logging.info(f"🔀 Bascule atomique effectuée pour {len(ordered)} tables")
+    drop_tables(engine, [t + '__old' for t in reversed(ordered)])
+
+
+# === FONCTION : Graphe des clés étrangères ===
+def fk_dependencies(table_definitions=TABLE_DEFINITIONS):
+    """Retourne {table: tables référencées} d'après les clauses REFERENCES des DDL"""
+    return {
+        table: set(re.findall(r"REFERENCES\s+`?(\w+)`?", ddl, re.IGNORECASE)) - {table}
+        for table, ddl in table_definitions.items()
+    }
+
+
+# === FONCTION : Chargement parallèle ordonné ===
+def load_tables_parallel(tasks, engine, max_workers=LOAD_WORKERS):
+    """Exécute les chargements `tasks` ({table: callable(engine=...)}) en parallèle sans violer l'ordre des FK.
+
+    Une table ne démarre qu'une fois chargées toutes les tables planifiées
+    dont elle dépend, directement ou via une table non planifiée.
+    """
+    graph = fk_dependencies()
+
+    def ancestors(table, seen=None):
+        seen = set() if seen is None else seen
+        for parent in graph.get(table, ()):
+            if parent not in seen:
+                seen.add(parent)
+                ancestors(parent, seen)
+        return seen
+
+    pending = {table: ancestors(table) & set(tasks) for table in tasks}
+    done = set()
+    logging.info(f"🧵 Chargement de {len(tasks)} tables sur {max_workers} connexions")
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        running = {}
+        while pending or running:
+            for table in [t for t, parents in pending.items() if parents <= done]:
+                del pending[table]
+                running[pool.submit(tasks[table], engine=engine)] = table
+            if not running:
+                raise ValueError(f"❌ Dépendances circulaires entre les tables : {sorted(pending)}")
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                table = running.pop(future)
+                future.result()
+                done.add(table)
+    logging.info(f"✅ Tables chargées : {', '.join(sorted(done))}")
 
 
 # === FONCTION : Export SQL complet ===
@@ -181,21 +1121,30 @@ def export_sql_complet():
 
 # === FONCTION : Export état des stocks ===
 def export_etat_stocks(engine):
+    """État des stocks par produit ; la production vient de PRODUCTION_REPORT_TABLE (totaux journaliers en PRODUCTION_PUSHDOWN)"""
     logging.info("📊 Génération de l'état des stocks par produit...")
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     output_file = f"{EXPORT_DIR}/etat_des_stocks_{timestamp}.csv"
 
-    query = """
+    # Chaque côté est agrégé par produit avant la jointure : les deux SUM ne se multiplient pas
+    query = f"""
     SELECT
         p.produit_id,
         p.nom_produit,
-        COALESCE(SUM(prod.quantite_produite), 0) AS quantite_produite,
-        COALESCE(SUM(lc.quantite), 0) AS quantite_vendue,
-        COALESCE(SUM(prod.quantite_produite), 0) - COALESCE(SUM(lc.quantite), 0) AS stock_disponible
+        COALESCE(prod.quantite_produite, 0) AS quantite_produite,
+        COALESCE(ventes.quantite_vendue, 0) AS quantite_vendue,
+        COALESCE(prod.quantite_produite, 0) - COALESCE(ventes.quantite_vendue, 0) AS stock_disponible
     FROM Produits p
-    LEFT JOIN Productions prod ON p.produit_id = prod.product_id
-    LEFT JOIN LignesCommande lc ON p.produit_id = lc.produit_id
-    GROUP BY p.produit_id, p.nom_produit
+    LEFT JOIN (
+        SELECT product_id, SUM(quantite_produite) AS quantite_produite
+        FROM {PRODUCTION_REPORT_TABLE}
+        GROUP BY product_id
+    ) prod ON p.produit_id = prod.product_id
+    LEFT JOIN (
+        SELECT produit_id, SUM(quantite) AS quantite_vendue
+        FROM LignesCommande
+        GROUP BY produit_id
+    ) ventes ON p.produit_id = ventes.produit_id
     ORDER BY p.produit_id;
     """
 
@@ -217,72 +1166,54 @@ def main():
 
     # --- 2. Créer l'engine SQLAlchemy ---
     mysql_url = f"mysql+mysqlconnector://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
-    engine = create_engine(mysql_url)
+    # LOAD DATA LOCAL INFILE doit être autorisé explicitement côté client
+    connect_args = {'allow_local_infile': True} if BULK_LOAD_TABLES else {}
+    engine = create_engine(mysql_url, connect_args=connect_args, pool_size=max(5, LOAD_WORKERS))
+    # Registre de clés neuf : partir des ids déjà chargés dans MySQL avant toute attribution
+    seed_key_registries(engine, ['commande', 'ligne'])
 
-    # --- 3. Extraire les données ---
-    df_csv = extract_csv(CSV_PATH)
-    sqlite_data = extract_sqlite(SQLITE_DB_PATH)
+    # --- 3. Extraire les données (CSV dans son thread, pendant la lecture des tables SQLite) ---
+    # En mode flux (CSV_CHUNKSIZE, un seul fichier), le CSV est lu bloc par bloc à l'étape 6
+    # Les tables fantômes partent vides : elles exigent une extraction complète
+    csv_incremental = CSV_CHECKPOINT and not SHADOW_LOAD
+    streaming = bool(CSV_CHUNKSIZE) and not CSV_SOURCES
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        if CSV_SOURCES:
+            csv_future = pool.submit(extract_commandes_files, CSV_SOURCES, csv_incremental)
+        else:
+            csv_future = None if streaming else pool.submit(extract_commandes, CSV_PATH, csv_incremental)
+        # En pushdown, la production brute ne quitte pas SQLite : seuls ses totaux sont extraits ;
+        # relue entièrement, elle est chargée page par page à l'étape 6
+        paged = production_paged(SQLITE_DB_PATH, incremental=not SHADOW_LOAD)
+        skip = {'production'} if PRODUCTION_PUSHDOWN or paged else set()
+        if SQLITE_CDC:
+            install_sqlite_cdc(SQLITE_DB_PATH)
+        sqlite_data = extract_sqlite(SQLITE_DB_PATH, incremental=not SHADOW_LOAD, skip=skip)
+        production_totals = extract_production_totals(SQLITE_DB_PATH) if PRODUCTION_PUSHDOWN else None
+        commandes, lignes = csv_future.result() if csv_future else (None, None)
+    # Limite de taille du cache appliquée une fois toutes les extractions terminées
+    evict_staging()
 
     # --- 4. Créer les tables ---
-    create_table_if_not_exists(engine, """
-    CREATE TABLE IF NOT EXISTS Regions (
-        region_id INT PRIMARY KEY,
-        nom_region VARCHAR(255)
-    )""")
-
-    create_table_if_not_exists(engine, """
-    CREATE TABLE IF NOT EXISTS Revendeurs (
-        revendeur_id INT PRIMARY KEY,
-        nom_revendeur VARCHAR(255),
-        region_id INT,
-        email_contact VARCHAR(255),
-        FOREIGN KEY (region_id) REFERENCES Regions(region_id)
-    )""")
-
-    create_table_if_not_exists(engine, """
-    CREATE TABLE IF NOT EXISTS Produits (
-        produit_id INT PRIMARY KEY,
-        nom_produit VARCHAR(255),
-        prix_unitaire FLOAT
-    )""")
-
-    create_table_if_not_exists(engine, """
-    CREATE TABLE IF NOT EXISTS Productions (
-        production_id INT PRIMARY KEY,
-        product_id INT,
-        quantite_produite INT,
-        date DATE
-    )""")
-
-    create_table_if_not_exists(engine, """
-    CREATE TABLE IF NOT EXISTS Commandes (
-        commande_id INT PRIMARY KEY,
-        numero_commande VARCHAR(255),
-        date_commande DATETIME,
-        revendeur_id INT,
-        FOREIGN KEY (revendeur_id) REFERENCES Revendeurs(revendeur_id)
-    )""")
-
-    create_table_if_not_exists(engine, """
-    CREATE TABLE IF NOT EXISTS LignesCommande (
-        ligne_id INT PRIMARY KEY,
-        commande_id INT,
-        produit_id INT,
-        quantite INT,
-        prix_unitaire_vente FLOAT,
-        FOREIGN KEY (commande_id) REFERENCES Commandes(commande_id),
-        FOREIGN KEY (produit_id) REFERENCES Produits(produit_id)
-    )""")
+    for create_table_sql in TABLE_DEFINITIONS.values():
+        create_table_if_not_exists(engine, create_table_sql)
 
-    # --- 5. Charger les données SQLite ---
+    # --- 5. Préparer le chargement de chaque table (l'engine est fourni à l'exécution) ---
+    # En chargement fantôme, les écritures visent <table>__next
+    suffix = SHADOW_SUFFIX if SHADOW_LOAD else ''
+    # En CDC, seules les lignes changées depuis le dernier chargement partent (sauf rechargement fantôme)
+    changes = {} if CDC_ENABLED and not SHADOW_LOAD else None
+    # Tables lues dans le changelog SQLite (SQLITE_CDC) : lignes modifiées et clés supprimées
+    log_changes = {}
+    tasks = {}
     if 'region' in sqlite_data:
         df = sqlite_data['region'].rename(columns={'region_name': 'nom_region'})
-        load_to_mysql_deduplicated(df, 'Regions', engine, pk_column='region_id')
+        tasks['Regions'] = dimension_task(df, 'region', 'Regions', 'region_id', suffix, changes, log_changes)
 
     if 'revendeur' in sqlite_data:
         df = sqlite_data['revendeur'].rename(columns={'revendeur_name': 'nom_revendeur'})
         df['email_contact'] = df['nom_revendeur'].apply(lambda x: f"{x.lower().replace(' ', '')}@exemple.com")
-        load_to_mysql_deduplicated(df, 'Revendeurs', engine, pk_column='revendeur_id')
+        tasks['Revendeurs'] = dimension_task(df, 'revendeur', 'Revendeurs', 'revendeur_id', suffix, changes, log_changes)
 
     if 'produit' in sqlite_data:
         df = sqlite_data['produit'].rename(columns={
@@ -290,38 +1221,54 @@ def main():
             'cout_unitaire': 'prix_unitaire',
             'product_id': 'produit_id'
         })
-        load_to_mysql_deduplicated(df, 'Produits', engine, pk_column='produit_id')
+        tasks['Produits'] = dimension_task(df, 'produit', 'Produits', 'produit_id', suffix, changes, log_changes)
 
-    if 'production' in sqlite_data:
-        df = sqlite_data['production'].rename(columns={
-            'quantity': 'quantite_produite',
-            'date_production': 'date',
-            'product_id': 'product_id'
-        })
-        df = df.reset_index()
-        load_to_mysql_deduplicated(df, 'Productions', engine, pk_column='production_id')
+    # Extraction incrémentale : les lignes absentes ne sont pas des suppressions
+    incremental = not SHADOW_LOAD and 'production' in INCREMENTAL_TABLES
+    if paged:
+        tasks['Productions'] = partial(load_production_pages, SQLITE_DB_PATH, suffix=suffix,
+                                       changes=None if incremental else changes, watermark=incremental)
+    elif 'production' in sqlite_data:
+        df = prepare_productions(sqlite_data['production'])
+        tasks['Productions'] = load_task(df, 'Productions', 'production_id', suffix, None if incremental else changes)
 
-    # --- 6. Traiter les commandes ---
-    df_csv = df_csv.rename(columns={
-        'numero_commande': 'numero_commande',
-        'commande_date': 'date_commande',
-        'quantity': 'quantite',
-        'unit_price': 'prix_unitaire_vente'
-    })
+    if production_totals is not None:
+        tasks['ProductionsJournalieres'] = partial(load_production_totals, production_totals,
+                                                   table_name='ProductionsJournalieres' + suffix)
 
-    # Générer un ID unique par commande
-    df_csv['commande_id'] = df_csv.groupby(['numero_commande', 'date_commande']).ngroup() + 1
+    if streaming:
+        # Commandes et LignesCommande sont chargées ensemble, bloc par bloc
+        tasks['LignesCommande'] = partial(load_commandes_streaming, CSV_PATH, chunksize=CSV_CHUNKSIZE,
+                                           table_suffix=suffix, incremental=csv_incremental)
+    else:
+        # Après une reprise, le CSV ne contient que les lignes ajoutées : pas de suppressions à déduire
+        csv_changes = None if csv_incremental else changes
+        tasks['Commandes'] = load_task(commandes, 'Commandes', 'commande_id', suffix, csv_changes)
+        tasks['LignesCommande'] = load_task(lignes, 'LignesCommande', 'ligne_id', suffix, csv_changes)
 
-    # Charger Commandes
-    commandes = df_csv[['commande_id', 'numero_commande', 'date_commande', 'revendeur_id']].drop_duplicates()
-    commandes['date_commande'] = pd.to_datetime(commandes['date_commande'])
-    load_to_mysql_deduplicated(commandes, 'Commandes', engine, pk_column='commande_id')
+    # --- 6. Charger les tables (en parallèle, dans l'ordre des clés étrangères) ---
+    # Suppressions relevées après le chargement : une table lue page par page ne les connaît qu'à la fin
+    loaded = set(tasks) | ({'Commandes'} if streaming else set())
+    with shadow_tables(engine, loaded) if SHADOW_LOAD else nullcontext():
+        if BULK_SESSION:
+            # Une seule connexion épinglée : les tables sont chargées l'une après l'autre
+            with bulk_load_session(engine, loaded, suffix) as conn:
+                load_tables_parallel(tasks, conn, max_workers=1)
+                removed = {**(changes or {}), **log_changes}
+                if removed:
+                    delete_removed_rows(conn, removed)
+        else:
+            load_tables_parallel(tasks, engine, LOAD_WORKERS)
+            removed = {**(changes or {}), **log_changes}
+            if removed:
+                delete_removed_rows(engine, removed)
 
-    # Charger LignesCommande
-    lignes = df_csv[['commande_id', 'product_id', 'quantite', 'prix_unitaire_vente']].copy()
-    lignes.loc[:, 'ligne_id'] = range(1, len(lignes) + 1)
-    lignes = lignes.rename(columns={'product_id': 'produit_id'})
-    load_to_mysql_deduplicated(lignes, 'LignesCommande', engine, pk_column='ligne_id')
+    # L'état de référence du CDC n'avance qu'après un chargement réussi
+    for table_name, table_changes in (changes or {}).items():
+        save_fingerprints(table_name, table_changes['fingerprints'])
+    save_watermarks()
+    save_csv_checkpoints()
+    trim_changelog(SQLITE_DB_PATH)
 
     # --- 7. Exporter les rapports ---
     logging.info("📤 Génération des exports finaux")
@@ -12,6 +12,12 @@ source venv/bin/activate || {
     exit 1
 }
 
+# Sources inchangées depuis le dernier run réussi : sortie immédiate, sans toucher MySQL
+if python run_manifest.py; then
+    echo "⏭️  ETL sauté le $(date) : sources inchangées" >> etl_execution.log
+    exit 0
+fi
+
 # Lancer le script Python
 python distributech_etl_improved.py
 
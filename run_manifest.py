@@ -0,0 +1,111 @@
+"""Manifeste d'exécution de l'ETL : empreintes des sources du dernier run réussi.
+
+Si aucune source n'a changé depuis, le run planifié peut être sauté sans
+toucher MySQL. Ce module n'importe que la bibliothèque standard : la
+vérification en ligne de commande répond en quelques millisecondes.
+
+    python run_manifest.py   # code retour 0 : sources inchangées, 1 : run nécessaire
+"""
+import hashlib
+import json
+import os
+import sys
+
+RUN_MANIFEST_PATH = './data/run_manifest.json'
+SQLITE_MAGIC = b'SQLite format 3\x00'
+
+
+# === FONCTION : Empreinte rapide d'un fichier ===
+def file_stat(path):
+    """Taille, mtime et, pour une base SQLite, compteur de modifications de l'en-tête.
+
+    PRAGMA data_version n'a de sens qu'au sein d'une connexion : d'un
+    processus à l'autre, c'est le compteur de l'en-tête (octets 24-27),
+    incrémenté à chaque transaction validée, qui trahit une écriture.
+    """
+    stat = os.stat(path)
+    fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    with open(path, 'rb') as f:
+        header = f.read(28)
+    if header.startswith(SQLITE_MAGIC):
+        fingerprint['change_counter'] = int.from_bytes(header[24:28], 'big')
+    return fingerprint
+
+
+def content_hash(path):
+    """SHA-256 du contenu du fichier (lu par blocs de 1 Mo)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(1 << 20), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+# === FONCTION : Empreintes des sources ===
+def source_paths(paths):
+    """Sources à suivre : les fichiers donnés et le journal WAL des bases SQLite s'il existe"""
+    return [p for path in paths for p in (path, path + '-wal') if p == path or os.path.exists(p)]
+
+
+def source_fingerprints(paths):
+    """Empreintes (taille, mtime, compteur SQLite) de chaque source, plus le SHA-256 des fichiers hors SQLite.
+
+    Le compteur de l'en-tête suffit à dater une base SQLite : elle n'est
+    jamais relue en entier.
+    """
+    fingerprints = {}
+    for path in source_paths(paths):
+        fingerprints[path] = file_stat(path)
+        if 'change_counter' not in fingerprints[path]:
+            fingerprints[path]['sha256'] = content_hash(path)
+    return fingerprints
+
+
+# === FONCTION : Lire / écrire le manifeste ===
+def load_manifest(path=RUN_MANIFEST_PATH):
+    """Empreintes du dernier run réussi ({} au premier passage)"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(fingerprints, path=RUN_MANIFEST_PATH):
+    """Enregistre les empreintes des sources du run qui vient de réussir (remplacement atomique)"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(fingerprints, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+# === FONCTION : Sources inchangées ? ===
+def sources_unchanged(paths=None, manifest_path=RUN_MANIFEST_PATH):
+    """True si chaque source est identique à celle du dernier run réussi.
+
+    Sans `paths`, les sources enregistrées dans le manifeste. Taille, mtime
+    et compteur SQLite suffisent quand ils sont égaux ; le hash n'est
+    recalculé que pour un fichier touché, et un contenu identique compte
+    comme inchangé. Une base SQLite touchée (sans hash) compte comme modifiée.
+    """
+    manifest = load_manifest(manifest_path)
+    if not manifest:
+        return False
+    paths = list(manifest) if paths is None else paths
+    if not all(os.path.exists(path) for path in paths):
+        return False
+    if set(source_paths([p for p in paths if not p.endswith('-wal')])) != set(manifest):
+        return False
+    for path, recorded in manifest.items():
+        current = file_stat(path)
+        if current.get('change_counter') != recorded.get('change_counter'):
+            return False
+        if (current['size'], current['mtime_ns']) != (recorded['size'], recorded['mtime_ns']):
+            if (current['size'] != recorded['size'] or 'sha256' not in recorded
+                    or content_hash(path) != recorded['sha256']):
+                return False
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if sources_unchanged() else 1)